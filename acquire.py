@@ -4,46 +4,811 @@
 # import from python libraries and modules
 import pandas as pd
 import numpy as np
-from os.path import isfile
+import json
+from hashlib import sha1
+from os import listdir, makedirs, replace, stat
+from os.path import basename, isdir, isfile, join
+from shutil import rmtree
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+from sqlalchemy import create_engine
 
 # import functions from created modules
-from env import get_connection
+from stages import stage
+
+
+# directory holding cached query returns
+CACHE_DIR = 'cache'
+
+# use parquet when pyarrow is available, otherwise fall back to pickle,
+# both of which store typed columns and load without any text parsing
+try:
+    import pyarrow
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pkl'
+
+
+# pooled engines per database name and lock guarding their creation
+_engines = {}
+_engines_lock = Lock()
+
+
+#################### Connect Data ####################
+
+
+def make_engine(url, **kwargs):
+    '''
+
+    Takes SQLAlchemy URL as `string` and returns an engine with a
+    connection pool, passing any keyword arguments to create_engine
+
+    '''
+
+    # only server databases accept queue pool sizing
+    if url.startswith('sqlite') == False:
+        kwargs.setdefault('pool_size', 5)
+        kwargs.setdefault('max_overflow', 5)
+    # check connections are alive before handing them out
+    kwargs.setdefault('pool_pre_ping', True)
+    engine = create_engine(url, **kwargs)
+
+    return engine
+
+
+def register_engine(db_name, url, **kwargs):
+    '''
+
+    Takes database name and SQLAlchemy URL as `string` and registers a
+    pooled engine for that database name, replacing any existing one.
+    Used to point acquisition at another server or at a local SQLite
+    stand-in, e.g. register_engine('zillow', 'sqlite:///zillow.db')
+
+    Any keyword arguments are passed through to create_engine
+
+    '''
+
+    # swap new engine into place
+    engine = make_engine(url, **kwargs)
+    with _engines_lock:
+        old = _engines.get(db_name)
+        _engines[db_name] = engine
+    # close sockets held by replaced engine
+    if old is not None:
+        old.dispose()
+
+    return engine
+
+
+def get_engine(db_name):
+    '''
+
+    Takes database name as `string` and returns the pooled engine for
+    that database, creating it from get_connection in env.py on first
+    use. Every acquisition against the same database reuses the pooled
+    connections of this engine
+
+    '''
+
+    # return existing engine if one is registered
+    engine = _engines.get(db_name)
+    if engine is None:
+        # only require env.py once a server connection is needed
+        from env import get_connection
+        with _engines_lock:
+            # check again in case another thread created it meanwhile
+            engine = _engines.get(db_name)
+            if engine is None:
+                engine = make_engine(get_connection(db_name))
+                _engines[db_name] = engine
+
+    return engine
+
+
+def dispose_engines():
+    '''
+
+    Closes all pooled connections and forgets every registered engine
+
+    '''
+
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+
+# release pooled connections when the interpreter exits
+atexit.register(dispose_engines)
+
+
+#################### Cache Data ####################
+
+
+def normalize_query(query):
+    '''
+
+    Takes SQL query as `string` and returns it with all whitespace
+    collapsed and trailing semicolon removed, so that the same query
+    written with different formatting obtains the same cache key
+
+    '''
+
+    # collapse whitespace and strip trailing semicolon
+    query = ' '.join(query.split()).rstrip(';').strip()
+
+    return query
+
+
+def cache_path(query, db_name):
+    '''
+
+    Takes SQL query and database name as `string` and returns the path
+    of the cache directory for that query, keyed by a hash of the
+    normalized query text and the database name
+
+    '''
+
+    # hash database name together with normalized query
+    key = sha1(f'{db_name}\n{normalize_query(query)}'.encode()).hexdigest()
+    path = join(CACHE_DIR, f'{db_name}_{key[:16]}')
+
+    return path
+
+
+def cache_parts(path):
+    '''
+
+    Takes cache path and returns the sorted list of part files written
+    to it, or an empty list if the cache does not exist
+
+    '''
+
+    # check if cache directory exists
+    if isdir(path) == False:
+        return []
+    # list part files in write order
+    parts = sorted(join(path, name) for name in listdir(path)
+                   if name.startswith('part-'))
+
+    return parts
+
+
+def write_part(df, path, part=0):
+    '''
+
+    Takes DataFrame, cache path and part number and writes the DataFrame
+    to disk in the binary cache format as one part of the cached return
+
+    '''
+
+    # create cache directory if it does not already exist
+    makedirs(path, exist_ok=True)
+    # write typed columns to disk
+    part_path = join(path, f'part-{part:05d}.{CACHE_FORMAT}')
+    if CACHE_FORMAT == 'parquet':
+        df.to_parquet(part_path, index=False)
+    else:
+        df.to_pickle(part_path)
+
+
+def read_part(part_path):
+    '''
+
+    Takes path of a single part file and reads it into DataFrame
+
+    '''
+
+    # read typed columns from disk
+    if part_path.endswith('.parquet'):
+        df = pd.read_parquet(part_path)
+    else:
+        df = pd.read_pickle(part_path)
+
+    return df
+
+
+def iter_cache(path):
+    '''
+
+    Takes cache path and yields the cached query return one part at a
+    time, so callers can stream over the cache with bounded memory
+
+    '''
+
+    for part_path in cache_parts(path):
+        yield read_part(part_path)
+
+
+def cache_version(path):
+    '''
+
+    Takes cache path and returns a tuple of the name, size and
+    modification time of every file in the cache, which changes whenever
+    the cache is rewritten or appended to
+
+    '''
+
+    # describe each part and metadata file
+    files = cache_parts(path) + [join(path, 'meta.json')]
+    version = tuple((basename(file), stat(file).st_size, stat(file).st_mtime_ns)
+                    for file in files if isfile(file))
+
+    return version
+
+
+@stage('read_cache', persist=False)
+def _read_cache_version(path, version):
+    '''
+
+    Reads cache at path, memoized by its version so an unchanged cache is
+    only read from disk once per session. Never persisted since the cache
+    is already on disk
+
+    '''
+
+    # read and combine each part in order
+    df = pd.concat(iter_cache(path), ignore_index=True)
+
+    return df
+
+
+def read_cache(path):
+    '''
+
+    Takes cache path and reads all parts of the cached query return
+    into a single DataFrame, reusing the frame already read this session
+    if the cache has not changed since
+
+    '''
+
+    df = _read_cache_version(path, cache_version(path))
+
+    return df
+
+
+def read_meta(path):
+    '''
+
+    Takes cache path and returns the metadata dictionary recorded with
+    the cache, holding the key column, its high-water mark and the
+    number of cached rows, or an empty dictionary if none was recorded
+
+    '''
+
+    # check if metadata was recorded
+    meta_path = join(path, 'meta.json')
+    if isfile(meta_path) == False:
+        return {}
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    return meta
+
+
+def write_meta(path, meta):
+    '''
+
+    Takes cache path and metadata dictionary and records it with the
+    cache
+
+    '''
+
+    with open(join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def _write_chunks(chunks, path, key=None, start=0, meta=None):
+    '''
+
+    Writes each chunk as its own part starting at part number start and
+    returns the metadata dictionary updated with the row count and, if
+    key is passed, the high-water mark of the key column
+
+    '''
+
+    # start from existing metadata when appending
+    meta = dict(meta or {'rows': 0})
+    if key != None:
+        meta['key'] = key
+    for part, chunk in enumerate(chunks, start=start):
+        write_part(chunk, path, part)
+        meta['rows'] += len(chunk)
+        # track highest key value written so far
+        if key != None and key in chunk and len(chunk) > 0:
+            high = chunk[key].max().item()
+            if meta.get('high_water') == None or high > meta['high_water']:
+                meta['high_water'] = high
+
+    return meta
+
+
+def iter_source(source, chunksize=100_000):
+    '''
+
+    Takes path to a cache directory, parquet file or CSV file and yields
+    its rows as DataFrame chunks of up to chunksize rows, so that files of
+    any size can be streamed with bounded memory. Cache directories are
+    streamed one part at a time
+
+    '''
+
+    # choose reader for source
+    if isdir(source):
+        yield from iter_cache(source)
+    elif source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, chunksize=chunksize)
+
+
+def write_cache(df, path, key=None):
+    '''
+
+    Takes DataFrame and cache path and replaces any existing cache at
+    that path with the DataFrame as a single part
+
+    '''
+
+    # replace existing cache with a single part
+    write_parts([df], path, key=key)
+
+
+def write_parts(chunks, path, key=None):
+    '''
+
+    Takes an iterable of DataFrame chunks and cache path and writes each
+    chunk as its own part, holding only one chunk in memory at a time.
+    Parts are written to a temporary directory which replaces any
+    existing cache once every chunk has been written
+
+    key=None records only the row count with the cache, default behavior
+
+    key='column' also records the high-water mark of that column, if
+    returned, for use in incremental refreshes
+
+    '''
+
+    # write parts to temporary directory so a failed pull leaves the
+    # existing cache intact
+    tmp_path = f'{path}.tmp'
+    if isdir(tmp_path):
+        rmtree(tmp_path)
+    makedirs(tmp_path)
+    meta = _write_chunks(chunks, tmp_path, key=key)
+    write_meta(tmp_path, meta)
+    # swap temporary directory into place
+    if isdir(path):
+        rmtree(path)
+    replace(tmp_path, path)
+
+
+def append_parts(chunks, path, key=None):
+    '''
+
+    Takes an iterable of DataFrame chunks and cache path and appends
+    each chunk as a new part after the existing ones, updating the
+    recorded row count and high-water mark. New parts are written to a
+    temporary directory and only moved into the cache once every chunk
+    has been written
+
+    '''
+
+    # write new parts to temporary directory numbered after existing ones
+    tmp_path = f'{path}.tmp'
+    if isdir(tmp_path):
+        rmtree(tmp_path)
+    makedirs(tmp_path)
+    chunks = (chunk for chunk in chunks if len(chunk) > 0)
+    meta = _write_chunks(chunks, tmp_path, key=key,
+                         start=len(cache_parts(path)), meta=read_meta(path))
+    # move new parts into cache, then record updated metadata
+    for part_path in cache_parts(tmp_path):
+        replace(part_path, join(path, basename(part_path)))
+    write_meta(path, meta)
+    rmtree(tmp_path)
+
+    return meta
+
+
+def downcast(df):
+    '''
+
+    Takes DataFrame and returns it with integer columns downcast to the
+    smallest integer type holding their values and float columns
+    downcast to float32 where no precision would be lost
+
+    '''
+
+    for col in df.select_dtypes('integer'):
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes('floating'):
+        # only use float32 if every value survives the round trip
+        values = df[col].to_numpy()
+        small = values.astype('float32')
+        if np.array_equal(small.astype(values.dtype), values, equal_nan=True):
+            df[col] = small
+
+    return df
 
 
 #################### Acquire Data ####################
 
 
-def get_sql(query, db_name, use_csv=True):
+def iter_sql(query, db_name, chunksize=100_000):
+    '''
+
+    Takes SQL query and database name as `string` and yields the query
+    return in DataFrame chunks of chunksize rows, using a server-side
+    cursor so that only one chunk is held in memory at a time. Each
+    chunk is downcast to compact dtypes before it is yielded
+
+    '''
+
+    # stream results through a server-side cursor on a pooled connection
+    with get_engine(db_name).connect() as con:
+        con = con.execution_options(stream_results=True)
+        for chunk in pd.read_sql(query, con, chunksize=chunksize):
+            yield downcast(chunk)
+
+
+def incremental_query(query, key, high_water):
+    '''
+
+    Takes SQL query, key column name and high-water mark and returns a
+    query selecting only the rows of the original query whose key is
+    greater than the high-water mark, ordered by the key
+
+    '''
+
+    # wrap original query and filter on its key column
+    query = f'''
+            SELECT *
+            FROM ({normalize_query(query)}) AS base
+            WHERE base.{key} > {high_water!r}
+            ORDER BY base.{key} ASC
+            ;'''
+
+    return query
+
+
+def get_sql(query, db_name, use_csv=True, chunksize=None, incremental=False,
+            key='property_id'):
     '''
 
     Takes SQL query and database name as `string` and runs through
-    pandas read_sql function, using get_connection from env.py.
-    Requires Codeup database login credentials.
+    pandas read_sql function on a pooled connection from get_engine.
+    Requires Codeup database login credentials in env.py unless an
+    engine has been registered for db_name with register_engine.
+
+    Query returns are cached in CACHE_DIR as parquet (or pickle if
+    pyarrow is not installed) under a name keyed by the query text and
+    database name, so different queries never share a cache
 
-    use_csv=True will use data from existing CSV file if one exists,
+    use_csv=True will use data from existing cache if one exists,
     default behavior
 
     use_csv=False will obtain new query return and overwrite existing
-    CSV if one exists
+    cache if one exists
+
+    chunksize=None will read the query return all at once, default
+    behavior
+
+    chunksize=n will stream the query return n rows at a time, writing
+    each downcast chunk to the cache as it arrives so that peak memory
+    during acquisition is a single chunk
+
+    incremental=False leaves an existing cache as is when use_csv=True
+    and replaces it when use_csv=False, default behavior
+
+    incremental=True fetches only rows whose key column is above the
+    high-water mark recorded with the cache and appends them to it,
+    performing a full pull if no cache or high-water mark exists yet.
+    The query must return the key column and should be ordered by it
 
     '''
 
-    # check if CSV file already exists or use_csv=False
-    if use_csv == False or isfile(f'{db_name}.csv') == False:
-        # acquire data from database
-        df = pd.read_sql(query, get_connection(db_name))
-        # write acquired data to CSV file
-        df.to_csv(f'{db_name}.csv', index=False)
-        # drop any existing duplicates
-        df.drop_duplicates()
-    else:
-        # read into DataFrame from CSV file
-        df = pd.read_csv(f'{db_name}.csv')
+    # assign cache for this query
+    path = cache_path(query, db_name)
+    has_cache = len(cache_parts(path)) > 0
+    # fetch only new rows when refreshing an existing cache
+    if incremental == True and has_cache:
+        high_water = read_meta(path).get('high_water')
+        if high_water == None:
+            # record high-water mark for caches written without one
+            high_water = read_cache(path)[key].max().item()
+            write_meta(path, {**read_meta(path), 'key': key,
+                              'high_water': high_water})
+        new_rows = incremental_query(query, key, high_water)
+        if chunksize == None:
+            with get_engine(db_name).connect() as con:
+                chunks = [pd.read_sql(new_rows, con)]
+        else:
+            chunks = iter_sql(new_rows, db_name, chunksize=chunksize)
+        append_parts(chunks, path, key=key)
+    # check if cache already exists or use_csv=False
+    elif use_csv == False or has_cache == False:
+        if chunksize == None:
+            # acquire data from database on a pooled connection
+            with get_engine(db_name).connect() as con:
+                df = pd.read_sql(query, con)
+            # write acquired data to cache
+            write_cache(df, path, key=key)
+            # drop any existing duplicates
+            df.drop_duplicates()
+            return df
+        # stream data from database into cache one chunk at a time
+        write_parts(iter_sql(query, db_name, chunksize=chunksize), path,
+                    key=key)
+    # read into DataFrame from cache
+    df = read_cache(path)
 
     return df
 
 
-def acquire_mvp(use_csv=False):
+def filtered_query(query, not_null=None, bounds=None, conditions=None,
+                   order_by=None):
+    '''
+
+    Takes SQL query and returns a query selecting only the rows of the
+    original query that pass the passed filters, so that filtering is
+    done by the database before any rows are transferred
+
+    not_null=['column'] keeps rows where each listed column is not null
+
+    bounds={'column': (lower, upper)} keeps rows where each column is
+    strictly between its lower and upper bound
+
+    conditions=['condition'] keeps rows meeting each SQL condition,
+    written against the column names returned by the original query
+
+    order_by='column' orders the returned rows by that column
+
+    '''
+
+    # build list of conditions against the wrapped query
+    where = [f'base.{col} IS NOT NULL' for col in (not_null or [])]
+    for col, (lower, upper) in (bounds or {}).items():
+        if np.isnan(lower) or np.isnan(upper):
+            raise ValueError(f'Bounds of {col} must be numbers, got '
+                             f'{(lower, upper)}')
+        where.append(f'base.{col} > {float(lower)!r} AND '
+                     f'base.{col} < {float(upper)!r}')
+    where += list(conditions or [])
+    # wrap original query and order by passed column
+    order = f' ORDER BY base.{order_by} ASC' if order_by != None else ''
+    query = f'''
+            SELECT *
+            FROM ({normalize_query(query)}) AS base
+            WHERE {' AND '.join(where) or '1 = 1'}{order}
+            ;'''
+
+    return query
+
+
+def zscore_bounds(query, db_name, columns, z=3, not_null=None, use_csv=True):
+    '''
+
+    Takes SQL query, database name and list of columns and returns a
+    dictionary of the lower and upper bounds z (default=3) population
+    standard deviations from the mean of each column, computed by the
+    database with an aggregate query over the rows of the original
+    query where each not_null column is not null. The aggregate return
+    is cached like any other query through get_sql. Columns without any
+    non-null values are left out of the bounds
+
+    '''
+
+    # aggregate mean and mean square of each column, which every database
+    # supports unlike STDDEV_POP
+    aggregates = ',\n'.join(f'''AVG(base.{col}) AS {col}_mean,
+                AVG(base.{col} * base.{col}) AS {col}_square'''
+                             for col in columns)
+    not_null = filtered_query(query, not_null=not_null)
+    stats_query = f'''
+            SELECT
+                {aggregates}
+            FROM ({normalize_query(not_null)}) AS base
+            ;'''
+    # NULL aggregates of columns without values become NaN
+    stats = get_sql(stats_query, db_name, use_csv=use_csv).iloc[0]
+    stats = stats.astype('float64')
+    # convert to bounds z standard deviations either side of mean
+    bounds = {}
+    for col in columns:
+        mean, square = stats[f'{col}_mean'], stats[f'{col}_square']
+        # skip columns without any values to bound
+        if np.isnan(mean) or np.isnan(square):
+            continue
+        std = max(square - mean ** 2, 0) ** 0.5
+        bounds[col] = (mean - z * std, mean + z * std)
+
+    return bounds
+
+
+def iter_sql_cached(query, db_name, use_csv=True, chunksize=100_000):
+    '''
+
+    Takes SQL query and database name as `string` and yields the cached
+    query return one part at a time, first streaming the query into the
+    cache in chunks of chunksize rows if no cache exists or use_csv=False.
+    Memory stays bounded by a single chunk throughout
+
+    '''
+
+    # assign cache for this query
+    path = cache_path(query, db_name)
+    # stream query into cache if needed
+    if use_csv == False or len(cache_parts(path)) == 0:
+        write_parts(iter_sql(query, db_name, chunksize=chunksize), path,
+                    key='property_id')
+    # stream cache back one part at a time
+    yield from iter_cache(path)
+
+
+def get_sql_many(queries, db_name, use_csv=True, chunksize=None,
+                 max_workers=None):
+    '''
+
+    Takes a dictionary of query names to SQL queries and a database name
+    as `string` and runs every query concurrently through get_sql on a
+    thread pool, each with its own cache, returning a dictionary of
+    query names to DataFrames. Names whose queries share a cache are run
+    once and each get their own copy of the result
+
+    max_workers=None runs up to one thread per distinct query capped at
+    the connection pool size, default behavior
+
+    All other arguments are passed to get_sql for every query
+
+    '''
+
+    # run identical queries only once since they share a cache
+    names_by_path = {}
+    for name, query in queries.items():
+        names_by_path.setdefault(cache_path(query, db_name), []).append(name)
+    if max_workers == None:
+        max_workers = min(len(names_by_path), 5) or 1
+    # create pooled engine before starting threads
+    get_engine(db_name)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {path: executor.submit(get_sql, queries[names[0]], db_name,
+                                         use_csv=use_csv, chunksize=chunksize)
+                   for path, names in names_by_path.items()}
+        # collect results in order passed, raising any error encountered
+        dfs = {}
+        for path, names in names_by_path.items():
+            df = futures[path].result()
+            # give every later name sharing a cache its own copy
+            for i, name in enumerate(names):
+                dfs[name] = df if i == 0 else df.copy()
+        dfs = {name: dfs[name] for name in queries}
+
+    return dfs
+
+
+#################### Zillow Schema ####################
+
+
+# compact dtypes for acquired zillow columns, with USD amounts kept as
+# float64 so that cents and tax rates are not rounded
+zillow_schema = {
+    'property_id': 'int32',
+    # mvp columns
+    'bedrooms': 'int8',
+    'bathrooms': 'float32',
+    'fips': 'int16',
+    'square_feet': 'float32',
+    'tax_amount_usd': 'float64',
+    'tax_value_usd': 'float64',
+    # wrangled columns
+    'bedroomcnt': 'int8',
+    'calculatedbathnbr': 'float32',
+    'calculatedfinishedsquarefeet': 'float32',
+    # degrees times one million, beyond the integers float32 holds exactly
+    'latitude': 'int32',
+    'longitude': 'int32',
+    'regionidzip': 'int32',
+    'taxvaluedollarcnt': 'float64',
+}
+
+
+def apply_schema(df, schema=zillow_schema):
+    '''
+
+    Takes DataFrame and returns it with each column and the index named
+    in schema converted to its declared dtype. Integer columns holding
+    nulls are converted to the matching nullable integer dtype instead
+
+    '''
+
+    for col in df.columns.intersection(list(schema)):
+        dtype = schema[col]
+        # nullable integers keep missing values
+        if dtype.startswith('int') and df[col].isna().any():
+            dtype = dtype.capitalize()
+        df[col] = df[col].astype(dtype)
+    # convert index if it is named in schema
+    if df.index.name in schema:
+        df.index = df.index.astype(schema[df.index.name])
+
+    return df
+
+
+#################### Zillow Queries ####################
+
+
+# MVP variables for single unit properties sold May through August 2017
+mvp_query = '''
+SELECT
+    properties_2017.id AS property_id,
+    bedroomcnt AS bedrooms,
+    bathroomcnt AS bathrooms,
+    fips,
+    calculatedfinishedsquarefeet AS square_feet,
+    taxamount AS tax_amount_usd,
+    taxvaluedollarcnt AS tax_value_usd
+FROM properties_2017
+INNER JOIN predictions_2017 USING(parcelid)
+LEFT JOIN propertylandusetype USING(propertylandusetypeid)
+WHERE
+    propertylandusetypeid IN (261, 263, 264, 266, 268, 275, 276, 279) AND
+    CAST(transactiondate AS DATE) BETWEEN 20170501 AND 20170831
+ORDER BY
+    properties_2017.id ASC
+;'''
+
+# tax amount and value of every property with a positive tax value
+tax_query = '''
+SELECT
+    properties_2017.id AS property_id,
+    fips,
+    regionidzip,
+    taxamount AS tax_amount_usd,
+    taxvaluedollarcnt AS tax_value_usd
+FROM properties_2017
+WHERE
+    taxamount IS NOT NULL AND
+    taxvaluedollarcnt > 0
+ORDER BY
+    properties_2017.id ASC
+;'''
+
+# property land use type lookup table
+landuse_query = '''
+SELECT
+    propertylandusetypeid,
+    propertylandusedesc
+FROM propertylandusetype
+ORDER BY
+    propertylandusetypeid ASC
+;'''
+
+
+# columns every MVP row must have
+mvp_not_null = ['bedrooms', 'bathrooms', 'fips', 'square_feet',
+                'tax_amount_usd', 'tax_value_usd']
+
+
+def mvp_bounds(use_csv=False):
+    '''
+
+    Returns dictionary of the lower and upper 3 stdev bounds of every MVP
+    column but fips over the non-null rows, computed by the database
+
+    '''
+
+    # obtain 3 stdev bounds of non-null rows from aggregate query
+    return zscore_bounds(mvp_query, 'zillow',
+                         [col for col in mvp_not_null if col != 'fips'],
+                         not_null=mvp_not_null, use_csv=use_csv)
+
+
+def acquire_mvp(use_csv=False, pushdown=False, return_bounds=False):
     '''
 
     Using get_sql function we pass a specific query to obtain the MVP'
@@ -52,32 +817,40 @@ def acquire_mvp(use_csv=False):
 
     This function acquires only the data need to construct the MVP
 
+    pushdown=False acquires every row and drops nulls in pandas, default
+    behavior
+
+    pushdown=True has the database drop rows with nulls, with zero
+    bedrooms or bathrooms, or with values more than three standard
+    deviations from the mean of any column but fips, so only rows that
+    prepare_mvp would keep are transferred
+
+    return_bounds=True also returns the dictionary of outlier bounds the
+    database filtered with, or None when pushdown=False
+
     '''
 
-    # assign sql query for specified data
-    query = '''
-            SELECT
-                properties_2017.id AS property_id,
-                bedroomcnt AS bedrooms,
-                bathroomcnt AS bathrooms,
-                fips,
-                calculatedfinishedsquarefeet AS square_feet,
-                taxamount AS tax_amount_usd,
-                taxvaluedollarcnt AS tax_value_usd
-            FROM properties_2017
-            INNER JOIN predictions_2017 USING(parcelid)
-            LEFT JOIN propertylandusetype USING(propertylandusetypeid)
-            WHERE
-                propertylandusetypeid IN (261, 263, 264, 266, 268, 275, 276, 279) AND
-                CAST(transactiondate AS DATE) BETWEEN 20170501 AND 20170831
-            ORDER BY
-                properties_2017.id ASC
-            ;'''
+    # check if filtering should be done by database
+    if pushdown == True:
+        bounds = mvp_bounds(use_csv=use_csv)
+        query = filtered_query(mvp_query, not_null=mvp_not_null,
+                               bounds=bounds,
+                               conditions=['base.bedrooms != 0',
+                                           'base.bathrooms != 0'],
+                               order_by='property_id')
+    else:
+        query = mvp_query
+        bounds = None
     # use get_sql function to read into DataFrame
     df = get_sql(query, 'zillow', use_csv=use_csv)
     # set id to index
     df = df.set_index('property_id')
     # drop rows with null values
     df = df.dropna()
+    # convert columns to compact dtypes
+    df = apply_schema(df)
+    # check if bounds are returned
+    if return_bounds == True:
+        return df, bounds
 
     return df
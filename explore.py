@@ -4,7 +4,7 @@
 # import from python libraries and modules
 import pandas as pd
 import numpy as np
-from scipy.stats import pearsonr, spearmanr
+from scipy.stats import t as t_dist
 
 # import visual tools
 import matplotlib.pyplot as plt
@@ -12,6 +12,9 @@ import seaborn as sns
 
 # import from created modules
 from prepare import prepare_mvp, split_data
+from stages import stage
+from summary import decimate, pairwise_moments, summarize
+from taxes import TaxRateStats, plot_tax_rates
 
 
 #################### Explore Data ####################
@@ -30,22 +33,49 @@ def get_tax_rates(use_csv=True):
     # convert into tax rate DataFrame
     df['tax_rate'] = df.tax_amount_usd / df.tax_value_usd
     df = df[['county', 'tax_amount_usd', 'tax_value_usd', 'tax_rate']].sort_values('county')
-    # set figure dimensions for plot
-    plt.figure(figsize=(30,15))
-    # start plot
-    plt.hist(df[df.county == 'Los Angeles'].tax_rate, bins=np.linspace(0, 0.1, 50), color='red', alpha=0.25, log=True, label='Los Angeles')
-    plt.hist(df[df.county == 'Orange'].tax_rate, bins=np.linspace(0, 0.1, 50), color='green', alpha=0.25, log=True, label='Orange')
-    plt.hist(df[df.county == 'Ventura'].tax_rate, bins=np.linspace(0, 0.1, 50), color='blue', alpha=0.25, log=True, label='Ventura')
-    plt.rcParams['legend.title_fontsize'] = 20
-    plt.xlim(0, 0.1)
-    plt.xlabel('Tax Rate')
-    plt.title('Distributions of Tax Rates for Each County')
-    plt.legend(title='County')
-    plt.show()
+    # plot distributions from binned counts of each county
+    plot_tax_rates(TaxRateStats().update(df))
     
     return df
 
 
+def tax_rate_table(df, by='county', tax_amount='tax_amount_usd',
+                   tax_value='tax_value_usd'):
+    '''
+
+    Takes in DataFrame with property tax payments and tax values and
+    returns a DataFrame of tax rates for each group in a single groupby
+    pass. by can be any column name or list of column names, e.g.
+    'county' or 'regionidzip' to obtain rates per zip code
+
+    For each group returns the mean tax amount and tax value, mean and
+    median of the per property tax rate, count of properties, and the
+    weighted tax rate of total tax amount over total tax value
+
+    '''
+
+    # assign per property tax rate alongside grouping columns
+    by = [by] if isinstance(by, str) else list(by)
+    df = df[by + [tax_amount, tax_value]].assign(
+                                    tax_rate=df[tax_amount] / df[tax_value])
+    # aggregate every group in one pass
+    df_taxes = df.groupby(by, observed=True, sort=True).agg(
+                            avg_tax_amount_usd=(tax_amount, 'mean'),
+                            avg_tax_value_usd=(tax_value, 'mean'),
+                            tax_rate=('tax_rate', 'mean'),
+                            median_tax_rate=('tax_rate', 'median'),
+                            properties=('tax_rate', 'size'),
+                            total_tax_amount_usd=(tax_amount, 'sum'),
+                            total_tax_value_usd=(tax_value, 'sum'))
+    # weight rate by value of each property
+    df_taxes['weighted_tax_rate'] = (df_taxes.total_tax_amount_usd /
+                                     df_taxes.total_tax_value_usd)
+    df_taxes = df_taxes.drop(columns=['total_tax_amount_usd',
+                                      'total_tax_value_usd'])
+
+    return df_taxes
+
+
 def get_tax_rates_county(use_csv=True):
     '''
 
@@ -57,20 +87,9 @@ def get_tax_rates_county(use_csv=True):
 
     # obtain prepared data to get tax rates
     df = prepare_mvp(use_csv=use_csv)
-    # assign blank DataFrame to append to
-    df_taxes = pd.DataFrame()
-    # start loop for each county in DataFrame
-    for county_name in df.county.sort_values().unique():
-        # set mask to filter values per county
-        subset = df[df.county == county_name]
-        # append dictionary to DataFrame values for each county
-        df_taxes = df_taxes.append({
-            'county_name': county_name,
-            'avg_tax_amount_usd': subset.tax_amount_usd.mean(),
-            'avg_tax_value_usd': subset.tax_value_usd.mean(),
-            'tax_rate': (subset.tax_amount_usd / subset.tax_value_usd).mean()
-            }, ignore_index=True)
-    df = df_taxes.set_index('county_name')
+    # aggregate tax rates for every county at once
+    df = tax_rate_table(df, by='county')
+    df.index.name = 'county_name'
 
     return df
 
@@ -117,6 +136,82 @@ def explore_mvp(use_csv=True):
 
 
 
+@stage('correlations')
+def correlations(data, columns=None):
+    '''
+
+    Takes in a DataFrame and optional list of columns and returns a tidy
+    DataFrame indexed by every ordered pair of numeric columns (x, y) with
+    the number of rows where both have values and the pearson and
+    spearman r and their p values over those rows, computed for all pairs
+    at once. Each column is ranked once for spearman r, and only pairs
+    with rows missing a value in just one of the columns are ranked again
+    over their own rows. Memoized by the content of the data
+
+    '''
+
+    # use passed or all numeric columns
+    if columns == None:
+        columns = list(data.select_dtypes('number'))
+    values = data[columns].to_numpy(dtype='float64', na_value=np.nan)
+    ranks = data[columns].rank().to_numpy(dtype='float64', na_value=np.nan)
+    # pearson r of values and spearman r as pearson r of ranks, each over
+    # the rows complete in the pair
+    n, _, cross, squares = pairwise_moments(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pearson = cross / np.sqrt(squares * squares.T)
+        _, _, cross, squares = pairwise_moments(ranks)
+        spearman = cross / np.sqrt(squares * squares.T)
+    # rank again pairs whose complete rows are not every row of both
+    counts = np.diag(n)
+    for i, j in zip(*np.nonzero((n != counts[:, None]) |
+                                (n != counts[None, :]))):
+        if i < j:
+            pair = data[[columns[i], columns[j]]].dropna().rank()
+            r = np.corrcoef(pair.to_numpy(dtype='float64'), rowvar=False)
+            spearman[i, j] = spearman[j, i] = np.atleast_2d(r)[0, -1]
+
+    def p_values(r):
+        # two sided p value of t statistic with n - 2 degrees of freedom
+        r = np.clip(r, -1, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = r * np.sqrt((n - 2) / (1 - r ** 2))
+        return 2 * t_dist.sf(np.abs(t), n - 2)
+
+    # arrange ordered pairs of distinct columns into tidy table
+    x, y = np.nonzero(~np.eye(len(columns), dtype=bool))
+    df_corr = pd.DataFrame({
+        'n': n[x, y].astype('int64'),
+        'pearson_r': pearson[x, y],
+        'pearson_p': p_values(pearson)[x, y],
+        'spearman_r': spearman[x, y],
+        'spearman_p': p_values(spearman)[x, y],
+        }, index=pd.MultiIndex.from_arrays(
+                    [np.array(columns)[x], np.array(columns)[y]],
+                    names=['x', 'y']))
+
+    return df_corr
+
+
+def corr_matrix(data, r_type='pearson'):
+    '''
+
+    Takes in a DataFrame and returns a square DataFrame of the pearson
+    (default) or spearman r between every pair of numeric columns, taken
+    from the correlations table
+
+    '''
+
+    # pivot tidy table into square matrix with ones on diagonal
+    columns = list(data.select_dtypes('number'))
+    corr = correlations(data)[f'{r_type}_r'].unstack()
+    values = corr.reindex(index=columns, columns=columns).to_numpy(copy=True)
+    np.fill_diagonal(values, 1)
+    corr = pd.DataFrame(values, index=columns, columns=columns)
+
+    return corr
+
+
 #################### Visualize Data ####################
 
 
@@ -133,9 +228,9 @@ def plot_heat(df, target):
     n_vars = len(list(df))
     # Set up large figure size for easy legibility
     plt.figure(figsize=(n_vars + 5, n_vars + 1))
-    # assign pd.corr() output to variable and create a mask to remove
+    # assign correlation matrix to variable and create a mask to remove
     # redundancy from graphic
-    corr = df.corr()
+    corr = corr_matrix(df)
     mask = np.triu(corr, k=0)
     # define custom cmap for heatmap where the darker the reds the more
     # positive and vice versa for blues
@@ -155,40 +250,81 @@ def plot_heat(df, target):
     plt.show()
 
 
+def plot_letter_values(summary, variable, color='tab:blue'):
+    '''
+
+    Draws an enhanced box plot of variable on the current axes from the
+    letter values precomputed in summary, nesting one box per letter
+    value from the quartiles outward
+
+    '''
+
+    ax = plt.gca()
+    boxes = summary.letter_values(variable)
+    # draw widest box first so narrower tails sit beneath it
+    for depth, (lower, upper) in enumerate(boxes):
+        height = 0.8 * (1 - depth / (len(boxes) + 1))
+        ax.add_patch(plt.Rectangle((lower, -height / 2), upper - lower,
+                                   height, facecolor=color, edgecolor='white',
+                                   alpha=1 - 0.8 * depth / len(boxes),
+                                   zorder=len(boxes) - depth))
+    # draw median line across widest box
+    median = summary.stats.loc[variable, 'median']
+    ax.plot([median, median], [-0.4, 0.4], color='black',
+            zorder=len(boxes) + 1)
+    ax.set_xlim(summary.stats.loc[variable, 'min'],
+                summary.stats.loc[variable, 'max'])
+    ax.set_ylim(-0.5, 0.5)
+    ax.set_yticks([])
+
+
 def plot_univariate(data, variable):
     '''
 
     This function takes the passed DataFrame the requested and plots a
     configured boxenplot and distrubtion for it side-by-side
 
+    Plots are drawn from the precomputed summary of the DataFrame, so
+    plotting further variables of the same data reuses it
+
     '''
 
+    # obtain precomputed statistics for data
+    summary = summarize(data)
+    median = summary.stats.loc[variable, 'median']
+    mean = summary.stats.loc[variable, 'mean']
+    counts, edges = summary.histograms[variable]
     # set figure dimensions
     plt.figure(figsize=(30,8))
     # start subplot 1 for boxenplot
     plt.subplot(1, 2, 1)
-    sns.boxenplot(x=variable, data=data)
-    plt.axvline(data[variable].median(), color='pink')
-    plt.axvline(data[variable].mean(), color='red')
+    plot_letter_values(summary, variable)
+    plt.axvline(median, color='pink')
+    plt.axvline(mean, color='red')
     plt.xlabel('')
     plt.title('Enchanced Box Plot', fontsize=25)
-    # start subplot 2 for displot
+    # start subplot 2 for distribution from binned counts
     plt.subplot(1, 2, 2)
-    sns.histplot(data=data, x=variable, element='step', kde=True, color='cyan',
-                                line_kws={'linestyle':'dashdot', 'alpha':1})
-    plt.axvline(data[variable].median(), color='pink')
-    plt.axvline(data[variable].mean(), color='red')
+    plt.hist(edges[:-1], bins=edges, weights=counts, histtype='step',
+             color='cyan')
+    # scale density to counts per bin
+    grid, density = summary.kde(variable)
+    plt.plot(grid, density * counts.sum() * (edges[1] - edges[0]),
+             color='cyan', linestyle='dashdot', alpha=1)
+    plt.axvline(median, color='pink')
+    plt.axvline(mean, color='red')
     plt.xlabel('')
     plt.ylabel('')
     plt.title('Distribution', fontsize=20)
     # set layout and show plot
-    plt.suptitle(f'{variable} $[n = {data[variable].count():,}]$', fontsize=25)
+    n = int(summary.stats.loc[variable, 'count'])
+    plt.suptitle(f'{variable} $[n = {n:,}]$', fontsize=25)
     plt.tight_layout()
     plt.show()
 
 
 def plot_discrete_to_continous(data, discrete_var, continous_var, swarm_n=2000,
-                                            r_type='pearson', random_state=19):
+                r_type='pearson', random_state=19, max_points=None):
     '''
 
     Takes in a DataFrame and lists of discrere and continuous variables and
@@ -196,13 +332,16 @@ def plot_discrete_to_continous(data, discrete_var, continous_var, swarm_n=2000,
     providing either the pearson (default) or spearman r measurement in the
     title
 
+    max_points=None plots every row in the regplot, default behavior
+
+    max_points=n plots at most n rows sampled across the range of the
+    continuous variable, with the regression line still fit to all rows
+
     '''
 
-    # choose coefficient
-    if r_type == 'pearson':
-        r = pearsonr(data[discrete_var], data[continous_var])[0]
-    elif r_type =='spearman':
-        r = spearmanr(data[discrete_var], data[continous_var])[0]
+    # choose coefficient from correlations table
+    summary = summarize(data)
+    r = correlations(data).loc[(discrete_var, continous_var), f'{r_type}_r']
     # set figure dimensions
     plt.figure(figsize=(30,10))
     # start subplot 1 for boxplot
@@ -216,10 +355,17 @@ def plot_discrete_to_continous(data, discrete_var, continous_var, swarm_n=2000,
                                                     random_state=random_state))
     plt.xlabel(f'{discrete_var}', fontsize=20)
     plt.ylabel('')
-    # start subplot 3 for boxplot
+    # start subplot 3 for regplot of sampled points
     plt.subplot(1, 3, 3)
-    sns.regplot(x=discrete_var, y=continous_var, data=data, marker='*',
-                                                    line_kws={'color':'red'})
+    sample = decimate(data, max_points=max_points, by=continous_var,
+                      random_state=random_state)
+    sns.regplot(x=discrete_var, y=continous_var, data=sample, marker='*',
+                                                    fit_reg=False)
+    # draw exact regression line of all rows from summary
+    slope, intercept = summary.line(discrete_var, continous_var)
+    x_line = np.array([summary.stats.loc[discrete_var, 'min'],
+                       summary.stats.loc[discrete_var, 'max']])
+    plt.plot(x_line, slope * x_line + intercept, color='red')
     plt.xlabel('')
     plt.ylabel('')
     # set title for graphic and output
@@ -229,24 +375,44 @@ def plot_discrete_to_continous(data, discrete_var, continous_var, swarm_n=2000,
     plt.show()
 
 
-def plot_joint(data, x, y, r_type='pearson'):
+def plot_joint(data, x, y, r_type='pearson', kind='scatter', max_points=None,
+               random_state=19):
     '''
 
     Takes in a DataFrame and the specified x, y variables and plots a
     configured joint plot with the pearson (default) or spearman r measurement
     in the title
 
+    kind='scatter' plots points, default behavior
+
+    kind='hex' plots the density of all rows in hexagonal bins instead
+
+    max_points=None plots every row when kind='scatter', default behavior
+
+    max_points=n plots at most n rows sampled across the range of y
+
+    The regression line is always fit to all rows
+
     '''
 
-    # choose coefficient
-    if r_type == 'pearson':
-        r = pearsonr(data[x], data[y])[0]
-    elif r_type =='spearman':
-        r = spearmanr(data[x], data[y])[0]
-    # plot jointplot of continuous variables
-    sns.jointplot(x, y, data, kind='reg', height=10,
-                  joint_kws={'marker':'+', 'line_kws':{'color':'red'}},
-                  marginal_kws={'color':'cyan'})
+    # choose coefficient from correlations table
+    summary = summarize(data)
+    r = correlations(data).loc[(x, y), f'{r_type}_r']
+    # plot jointplot of continuous variables from density bins or sample
+    if kind == 'hex':
+        grid = sns.jointplot(x=x, y=y, data=data, kind='hex', height=10,
+                             marginal_kws={'color':'cyan'})
+    else:
+        sample = decimate(data, max_points=max_points, by=y,
+                          random_state=random_state)
+        grid = sns.jointplot(x=x, y=y, data=sample, kind='scatter',
+                             height=10, marker='+',
+                             marginal_kws={'color':'cyan'})
+    # draw exact regression line of all rows from summary
+    slope, intercept = summary.line(x, y)
+    x_line = np.array([summary.stats.loc[x, 'min'],
+                       summary.stats.loc[x, 'max']])
+    grid.ax_joint.plot(x_line, slope * x_line + intercept, color='red')
     # set labels for x, y axes
     plt.xlabel(f'{x}')
     plt.ylabel(f'{y}')
@@ -267,11 +433,8 @@ def corr_test(data, x, y, alpha=0.05, r_type='pearson'):
     
     '''
     
-    # obtain r, p values
-    if r_type == 'pearson':
-        r, p = pearsonr(data[x], data[y])
-    if r_type == 'spearman':
-        r, p = spearmanr(data[x], data[y])
+    # obtain r, p values from correlations table
+    r, p = correlations(data).loc[(x, y), [f'{r_type}_r', f'{r_type}_p']]
     # print reject/fail statement
     print(f'''{r_type:>10} r = {r:.2g}
 +--------------------+''')
@@ -0,0 +1,362 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+
+# import from created modules
+from streaming import (bin_positions, grow_groups, histogram_quantiles,
+                       merge_moments)
+
+
+# quantiles of residuals reported for every model
+RESIDUAL_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# bin edges of residual histograms kept when streaming, $5,000 wide
+RESIDUAL_BINS = np.linspace(-2_000_000, 2_000_000, 801)
+
+# arrays of running metrics kept with one row per group of a breakdown
+STATE_ARRAYS = ('n', 'mean_y', 'm2_y', 'mean_r', 'm2_r', 'abs_r', 'counts')
+
+
+#################### Compute Residuals ####################
+
+
+def _residuals(y_true, y_predicted):
+    '''
+
+    Takes true values and one or more sets of predictions and returns
+    the float64 array of true values, the array of residuals with one
+    column per set of predictions, and the names of those sets
+
+    y_predicted may be a DataFrame or dictionary with one column per
+    model, a Series, or an array of one or more columns
+
+    '''
+
+    y = np.asarray(y_true, dtype='float64').ravel()
+    if isinstance(y_predicted, dict):
+        y_predicted = pd.DataFrame(y_predicted)
+    if isinstance(y_predicted, pd.DataFrame):
+        models = list(y_predicted)
+    elif isinstance(y_predicted, pd.Series):
+        models = [y_predicted.name or 'prediction']
+    else:
+        models = None
+    predicted = np.asarray(y_predicted, dtype='float64')
+    if predicted.ndim == 1:
+        predicted = predicted[:, None]
+    if models == None:
+        models = (['prediction'] if predicted.shape[1] == 1 else
+                  [f'prediction_{i}' for i in range(predicted.shape[1])])
+    # predicted minus true, matching plot_residuals
+    residuals = predicted - y[:, None]
+
+    return y, residuals, models
+
+
+def _drop_missing(y, residuals, by=None):
+    '''
+
+    Returns true values, residuals and group labels by of only the rows
+    with a true value and every prediction present
+
+    '''
+
+    complete = ~np.isnan(y) & ~np.isnan(residuals).any(axis=1)
+    if by is not None:
+        by = pd.Series(np.asarray(by)[complete],
+                       name=getattr(by, 'name', None))
+
+    return y[complete], residuals[complete], by
+
+
+def band_edges(y_true, bands=5):
+    '''
+
+    Takes true values and returns the edges of bands (default=5) value
+    bands holding equal numbers of properties
+
+    '''
+
+    return np.unique(np.quantile(np.asarray(y_true, dtype='float64'),
+                                 np.linspace(0, 1, bands + 1)))
+
+
+def _band_labels(bands):
+    return [f'${lower:,.0f} - ${upper:,.0f}'
+            for lower, upper in zip(bands[:-1], bands[1:])]
+
+
+def _breakdowns(y, by=None, bands=None):
+    '''
+
+    Yields (breakdown, codes, labels) for every breakdown of the rows:
+    'all' rows in one group, the groups of by if passed, and the value
+    bands of the true values between the edges of bands if passed. Rows
+    with a missing group have a code of -1
+
+    '''
+
+    yield 'all', np.zeros(len(y), dtype='int64'), ['all']
+    if by is not None:
+        codes, labels = pd.factorize(np.asarray(by), sort=True)
+        yield getattr(by, 'name', None) or 'group', codes, list(labels)
+    if bands is not None:
+        # values beyond the outer edges fall in the outer bands
+        codes = np.searchsorted(bands, y, side='right') - 1
+        codes = np.clip(codes, 0, len(bands) - 2)
+        yield 'value_band', codes, _band_labels(bands)
+
+
+def _group_moments(codes, y, residuals):
+    '''
+
+    Takes group codes, true values and residuals and returns the groups
+    present with their row counts, means and sums of squared deviations
+    of the true values and residuals and sums of absolute residuals,
+    along with the residuals sorted by group and the start of each group
+
+    '''
+
+    # sort rows by group once so every sum is a single reduceat
+    valid = codes >= 0
+    codes, y, residuals = codes[valid], y[valid], residuals[valid]
+    order = np.argsort(codes, kind='stable')
+    codes, y, residuals = codes[order], y[order], residuals[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    if len(codes) == 0:
+        starts = starts[:0]
+    groups = codes[starts]
+    n = np.diff(np.r_[starts, len(codes)])
+    # means and squared deviations of true values and residuals
+    mean_y = np.add.reduceat(y, starts) / n
+    m2_y = np.add.reduceat((y - np.repeat(mean_y, n)) ** 2, starts)
+    mean_r = np.add.reduceat(residuals, starts, axis=0) / n[:, None]
+    m2_r = np.add.reduceat((residuals - np.repeat(mean_r, n, axis=0)) ** 2,
+                           starts, axis=0)
+    abs_r = np.add.reduceat(np.abs(residuals), starts, axis=0)
+
+    return groups, n, mean_y, m2_y, mean_r, m2_r, abs_r, residuals, starts
+
+
+def _table(breakdown, labels, models, n, m2_y, mean_r, m2_r, abs_r,
+           quantiles, quantile_values):
+    '''
+
+    Returns DataFrame of metrics for every group and model indexed by
+    breakdown, group and model from the moments of each group
+
+    '''
+
+    n = n[:, None]
+    # squared error is the squared deviation plus the squared bias
+    sse = m2_r + n * mean_r ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            'n': np.broadcast_to(n, mean_r.shape),
+            'RMSE': np.sqrt(sse / n),
+            'MAE': abs_r / n,
+            'R^2': 1 - sse / m2_y[:, None],
+            'explained_variance': 1 - m2_r / m2_y[:, None],
+            'mean_residual': mean_r,
+            }
+    for i, q in enumerate(quantiles):
+        metrics[f'residual_q{q * 100:02.0f}'] = quantile_values[:, :, i]
+    index = pd.MultiIndex.from_product([[breakdown], labels, models],
+                                       names=['breakdown', 'group', 'model'])
+
+    return pd.DataFrame({key: np.ravel(value)
+                         for key, value in metrics.items()}, index=index)
+
+
+def compute_metrics(y_true, y_predicted):
+    '''
+
+    Takes true values and one or more sets of predictions and returns
+    dictionary of arrays of RMSE, MAE, R^2 and explained variance with
+    one value per set of predictions, in a single pass over the residuals
+
+    '''
+
+    y, residuals, _ = _residuals(y_true, y_predicted)
+    n = len(y)
+    m2_y = ((y - y.mean()) ** 2).sum()
+    mean_r = residuals.mean(axis=0)
+    m2_r = ((residuals - mean_r) ** 2).sum(axis=0)
+    sse = m2_r + n * mean_r ** 2
+
+    return {'RMSE': np.sqrt(sse / n),
+            'MAE': np.abs(residuals).sum(axis=0) / n,
+            'R^2': 1 - sse / m2_y,
+            'explained_variance': 1 - m2_r / m2_y}
+
+
+def evaluate(y_true, y_predicted, by=None, bands=None,
+             quantiles=RESIDUAL_QUANTILES):
+    '''
+
+    Takes true values and one or more sets of predictions, e.g. a
+    DataFrame with one column per model, and returns DataFrame of the
+    count, RMSE, MAE, R^2, explained variance, mean residual and residual
+    quantiles of every model, indexed by breakdown, group and model, with
+    residuals computed once for every breakdown
+
+    by=None reports every row as one 'all' group, default behavior
+
+    by=Series of group labels aligned with the rows, e.g. county, also
+    reports every group of by
+
+    Rows missing the true value or any prediction are left out
+
+    bands=n also reports n value bands of the true values holding equal
+    numbers of properties, while bands=[edges] uses those band edges
+
+    '''
+
+    y, residuals, models = _residuals(y_true, y_predicted)
+    y, residuals, by = _drop_missing(y, residuals, by)
+    if bands is not None and np.ndim(bands) == 0:
+        bands = band_edges(y, bands)
+    tables = []
+    for breakdown, codes, labels in _breakdowns(y, by, bands):
+        (groups, n, mean_y, m2_y, mean_r, m2_r, abs_r,
+         ordered, starts) = _group_moments(codes, y, residuals)
+        # exact quantiles of each group's contiguous sorted rows
+        ends = np.r_[starts[1:], len(ordered)]
+        values = np.array([np.quantile(ordered[start:end], quantiles, axis=0).T
+                           for start, end in zip(starts, ends)])
+        values = values.reshape(len(groups), len(models), len(quantiles))
+        tables.append(_table(breakdown, [labels[g] for g in groups], models,
+                             n, m2_y, mean_r, m2_r, abs_r, quantiles, values))
+
+    return pd.concat(tables)
+
+
+#################### Stream Metrics ####################
+
+
+class MetricsAccumulator:
+    '''
+
+    Maintains running metrics of one or more models against one target,
+    updated one chunk of predictions at a time so metrics over any number
+    of scored properties are computed with memory proportional to the
+    number of groups, models and bins only
+
+    For every group of each breakdown keeps the count of rows, running
+    mean and sum of squared deviations of the true values and residuals
+    (merged per chunk, Chan et al.), the sum of absolute residuals and
+    counts of residuals in each bin of bins (default RESIDUAL_BINS), from
+    which residual quantiles are approximated
+
+    bands=None reports no value bands, default behavior, while
+    bands=[edges] also reports the value bands between those edges, e.g.
+    the edges returned by band_edges on the training target
+
+    '''
+
+    def __init__(self, bands=None, bins=RESIDUAL_BINS,
+                 quantiles=RESIDUAL_QUANTILES):
+        self.bands = None if bands is None else np.asarray(bands,
+                                                           dtype='float64')
+        self.bins = np.asarray(bins)
+        self.quantiles = quantiles
+        self.models_ = None
+        self._state = {}
+
+    def update(self, y_true, y_predicted, by=None):
+        '''
+
+        Takes true values and one or more sets of predictions of a chunk,
+        and group labels by aligned with them, e.g. county, and merges the
+        chunk into the running metrics of every group. Rows missing the
+        true value or any prediction are left out
+
+        '''
+
+        y, residuals, models = _residuals(y_true, y_predicted)
+        if self.models_ == None:
+            self.models_ = models
+        elif models != self.models_:
+            raise ValueError(f'Expected predictions of {self.models_}, '
+                             f'got {models}')
+        y, residuals, by = _drop_missing(y, residuals, by)
+        if len(y) == 0:
+            return self
+        bin_ = bin_positions(residuals, self.bins)
+        width = len(self.bins) + 1
+        for breakdown, codes, labels in _breakdowns(y, by, self.bands):
+            if breakdown not in self._state:
+                n_models = len(self.models_)
+                self._state[breakdown] = {
+                    'labels': [], 'positions': {},
+                    'n': np.zeros(0, dtype='int64'),
+                    'mean_y': np.zeros(0), 'm2_y': np.zeros(0),
+                    'mean_r': np.zeros((0, n_models)),
+                    'm2_r': np.zeros((0, n_models)),
+                    'abs_r': np.zeros((0, n_models)),
+                    'counts': np.zeros((0, n_models, width), dtype='int64')}
+            state = self._state[breakdown]
+            (groups, n, mean_y, m2_y, mean_r, m2_r, abs_r,
+             _, _) = _group_moments(codes, y, residuals)
+            positions = grow_groups(state, STATE_ARRAYS, state['positions'],
+                                    state['labels'],
+                                    [labels[g] for g in groups])
+            # merge chunk means and squared deviations into running values
+            seen = state['n'][positions]
+            _, state['mean_y'][positions], state['m2_y'][positions] = (
+                    merge_moments(seen, state['mean_y'][positions],
+                                  state['m2_y'][positions], n, mean_y, m2_y))
+            _, state['mean_r'][positions], state['m2_r'][positions] = (
+                    merge_moments(seen[:, None], state['mean_r'][positions],
+                                  state['m2_r'][positions], n[:, None],
+                                  mean_r, m2_r))
+            state['abs_r'][positions] += abs_r
+            state['n'][positions] = seen + n
+            # count residuals of each group, model and bin in one bincount
+            valid = codes >= 0
+            rows = np.repeat(np.searchsorted(groups, codes[valid]),
+                             len(self.models_))
+            cols = np.tile(np.arange(len(self.models_)), valid.sum())
+            flat = (rows * len(self.models_) + cols) * width
+            counts = np.bincount(flat + bin_[valid].ravel(),
+                                 minlength=len(groups) * len(self.models_) *
+                                 width)
+            state['counts'][positions] += counts.reshape(
+                                    len(groups), len(self.models_), width)
+
+        return self
+
+    def summary(self):
+        '''
+
+        Returns DataFrame of metrics of every model for every group of
+        each breakdown, as evaluate does, with residual quantiles
+        approximated from the histogram bins
+
+        '''
+
+        tables = []
+        for breakdown, state in self._state.items():
+            # order groups as evaluate does, value bands by their edges
+            labels = state['labels']
+            if breakdown == 'value_band':
+                key = _band_labels(self.bands).index
+            else:
+                key = None
+            order = [state['positions'][label]
+                     for label in sorted(labels, key=key)]
+            values = histogram_quantiles(state['counts'][order], self.bins,
+                                         self.quantiles)
+            tables.append(_table(breakdown, [labels[i] for i in order],
+                                 self.models_, state['n'][order],
+                                 state['m2_y'][order],
+                                 state['mean_r'][order],
+                                 state['m2_r'][order], state['abs_r'][order],
+                                 self.quantiles, values))
+        if len(tables) == 0:
+            return pd.DataFrame()
+
+        return pd.concat(tables)
@@ -4,27 +4,48 @@
 # import from python libraries and modules
 import pandas as pd
 import numpy as np
+import json
+import warnings
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 
 #import visualization tools
 import matplotlib.pyplot as plt
 
 # import modeling tools
-from sklearn.feature_selection import SelectKBest, f_regression, RFE
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.model_selection import ParameterGrid
+from sklearn.feature_selection import SelectKBest, f_regression, RFE, RFECV
 from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, explained_variance_score
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import PolynomialFeatures
+from sklearn.utils.validation import check_is_fitted
+
+# import from created modules
+from metrics import compute_metrics
+from registry import save_model
+from stages import stage
+from summary import decimate
 
 
 #################### Create & Test Models ####################
 
 
-def train_model(X, y, model, model_name):
+def train_model(X, y, model, model_name, register=False, scaler=None,
+                outliers=None):
     '''
 
     Takes in the X_train and y_train, model object and model name, fit the
     model and returns predictions and a dictionary containg the model RMSE
     and R^2 scores on train
 
+    register=True also saves the fitted model to the model registry with
+    its features, training data fingerprint, train metrics and the passed
+    fitted scaler, so it can be loaded later without refitting. Passing
+    the fitted OutlierFilter from prepare_mvp(return_filter=True) as
+    outliers also saves it, so scoring removes outliers with the same
+    bounds
+
     '''
 
     # fit model to X_train_scaled
@@ -34,6 +55,11 @@ def train_model(X, y, model, model_name):
     # get rmse and r^2 for model predictions on X
     rmse, r2 = get_metrics(y, predictions)
     performance_dict = {'model':model_name, 'RMSE':rmse, 'R^2':r2}
+    # check if model is registered
+    if register == True:
+        artifacts = {'outliers': outliers} if outliers is not None else {}
+        save_model(model_name, model, features=list(X), scaler=scaler,
+                   data=(X, y), metrics=performance_dict, **artifacts)
     
     return predictions, performance_dict
 
@@ -56,50 +82,498 @@ def model_testing(X, y, model, model_name):
     return predictions, performance_dict
 
 
+#################### Compare Models ####################
+
+
+# arrays shared with worker processes, attached once per worker
+_shared = {}
+
+
+def _share(array):
+    '''
+
+    Copies array into a new shared memory block and returns the block
+    with the name, shape and dtype workers need to attach to it
+
+    '''
+
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[:] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach(specs, columns):
+    '''
+
+    Worker initializer attaching to every shared array by name, so each
+    worker reads the data without it being pickled per task
+
+    '''
+
+    for key, (name, shape, dtype) in specs.items():
+        shm = SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    _shared['columns'] = columns
+
+
+def _fit_shared(task):
+    '''
+
+    Fits one estimator to the shared train arrays and returns its train
+    and validate metrics
+
+    '''
+
+    name, model = task
+    columns = _shared['columns']
+    # wrap shared arrays without copying to keep feature names
+    X_train = pd.DataFrame(_shared['X_train'][1], columns=columns, copy=False)
+    X_validate = pd.DataFrame(_shared['X_validate'][1], columns=columns,
+                              copy=False)
+    y_train = _shared['y_train'][1]
+    y_validate = _shared['y_validate'][1]
+    # fit and score model
+    model.fit(X_train, y_train)
+    train_rmse, train_r2 = get_metrics(y_train, model.predict(X_train))
+    validate_rmse, validate_r2 = get_metrics(y_validate,
+                                             model.predict(X_validate))
+
+    return {'model':name,
+            'train_RMSE':train_rmse, 'train_R^2':train_r2,
+            'validate_RMSE':validate_rmse, 'validate_R^2':validate_r2}
+
+
+def expand_grid(models):
+    '''
+
+    Takes dictionary of model names to estimators, or to tuples of
+    estimator and parameter grid dictionary, and returns a list of (name,
+    estimator) for every combination of parameters, naming each after its
+    parameters
+
+    '''
+
+    tasks = []
+    for name, model in models.items():
+        # check if a parameter grid was passed
+        if isinstance(model, tuple):
+            model, grid = model
+            for params in ParameterGrid(grid):
+                label = ', '.join(f'{key}={value}'
+                                  for key, value in params.items())
+                tasks.append((f'{name} ({label})',
+                              clone(model).set_params(**params)))
+        else:
+            tasks.append((name, clone(model)))
+
+    return tasks
+
+
+def compare_models(models, X_train, y_train, X_validate, y_validate,
+                   max_workers=None):
+    '''
+
+    Takes dictionary of model names to estimators, or to tuples of
+    estimator and parameter grid, e.g.
+    {'Lasso': (LassoLars(), {'alpha': [0.1, 1, 10]})}, and the X, y for
+    train and validate. Fits and evaluates every combination across a
+    process pool and returns a leaderboard DataFrame of RMSE and R^2 on
+    train and validate, sorted by validate RMSE
+
+    Data is placed once in shared memory and read by every worker rather
+    than pickled for each model
+
+    max_workers=None uses one process per CPU, default behavior
+
+    '''
+
+    # place each array in shared memory once
+    arrays = {'X_train': X_train.to_numpy(dtype='float64'),
+              'X_validate': X_validate.to_numpy(dtype='float64'),
+              'y_train': np.asarray(y_train, dtype='float64').ravel(),
+              'y_validate': np.asarray(y_validate, dtype='float64').ravel()}
+    blocks, specs = [], {}
+    try:
+        for key, array in arrays.items():
+            shm, specs[key] = _share(array)
+            blocks.append(shm)
+        # fit every model on workers attached to shared arrays
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach,
+                                 initargs=(specs, list(X_train))) as executor:
+            rows = list(executor.map(_fit_shared, expand_grid(models)))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    df = pd.DataFrame(rows).sort_values('validate_RMSE')
+    df = df.set_index('model')
+
+    return df
+
+
+#################### Stream Models ####################
+
+
+class NormalEquationRegressor(RegressorMixin, BaseEstimator):
+    '''
+
+    Least squares linear regression fit from the normal equations, whose
+    sufficient statistics XᵀX and Xᵀy are accumulated chunk by chunk, so
+    fitting over any number of rows needs memory proportional to the
+    number of features only, and new rows update a fitted model without
+    another pass over the old ones
+
+    degree=1 fits the features as passed, default behavior, while
+    degree=2 or more expands them to polynomial terms on the fly as
+    PolynomialFeatures does, without materializing the wider data
+
+    alpha=0 fits ordinary least squares, default behavior, while alpha
+    greater than 0 adds a ridge penalty to every coefficient but the
+    intercept
+
+    '''
+
+    def __init__(self, degree=1, alpha=0.0, fit_intercept=True):
+        self.degree = degree
+        self.alpha = alpha
+        self.fit_intercept = fit_intercept
+
+    def _expand(self, X):
+        '''
+
+        Returns float64 array of the polynomial terms of X
+
+        '''
+
+        values = np.asarray(X, dtype='float64')
+        # multiply features raised to each term's exponents
+        terms = np.ones((len(values), len(self.powers_)))
+        for i, powers in enumerate(self.powers_):
+            for j in np.flatnonzero(powers):
+                terms[:, i] *= values[:, j] ** powers[j]
+
+        return terms
+
+    def reset(self):
+        '''
+
+        Clears accumulated statistics so the next partial_fit starts over
+
+        '''
+
+        for attr in ('xtx_', 'xty_', 'n_samples_seen_', 'powers_',
+                     'feature_names_in_', 'n_features_in_', 'coef_',
+                     'intercept_'):
+            self.__dict__.pop(attr, None)
+
+        return self
+
+    def partial_fit(self, X, y):
+        '''
+
+        Takes X and y of a chunk of rows, adds their XᵀX and Xᵀy to the
+        accumulated statistics and solves for the coefficients of every
+        row seen so far
+
+        '''
+
+        # check chunk holds rows to accumulate
+        if len(y) == 0 or np.shape(X)[0] != len(y):
+            raise ValueError(f'Expected X and y with the same number of at '
+                             f'least 1 rows, got {np.shape(X)[0]} and '
+                             f'{len(y)}')
+        # set polynomial terms on first chunk
+        if hasattr(self, 'powers_') == False:
+            if hasattr(X, 'columns'):
+                self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+            self.n_features_in_ = np.shape(X)[1]
+            self.powers_ = PolynomialFeatures(
+                                self.degree, include_bias=False).fit(
+                                np.zeros((1, self.n_features_in_))).powers_
+            width = len(self.powers_) + int(self.fit_intercept)
+            self.xtx_ = np.zeros((width, width))
+            self.xty_ = np.zeros(width)
+            self.n_samples_seen_ = 0
+        # accumulate sufficient statistics of chunk
+        terms = self._expand(X)
+        if self.fit_intercept == True:
+            terms = np.hstack((np.ones((len(terms), 1)), terms))
+        target = np.asarray(y, dtype='float64').ravel()
+        self.xtx_ += terms.T @ terms
+        self.xty_ += terms.T @ target
+        self.n_samples_seen_ += len(target)
+
+        return self._solve()
+
+    def _solve(self):
+        '''
+
+        Solves the normal equations of the accumulated statistics for the
+        coefficients and intercept
+
+        '''
+
+        # penalize every term but the intercept
+        penalty = np.full(len(self.xty_), float(self.alpha))
+        if self.fit_intercept == True:
+            penalty[0] = 0
+        xtx = self.xtx_ + np.diag(penalty)
+        # rescale terms to unit diagonal to keep the solve well conditioned
+        scale = np.sqrt(np.diag(xtx))
+        scale[scale == 0] = 1
+        scaled = xtx / np.outer(scale, scale)
+        try:
+            beta = np.linalg.solve(scaled, self.xty_ / scale)
+        except np.linalg.LinAlgError:
+            # fall back to minimum norm solution of singular system
+            beta = np.linalg.lstsq(scaled, self.xty_ / scale, rcond=None)[0]
+        beta /= scale
+        if self.fit_intercept == True:
+            self.intercept_, self.coef_ = beta[0], beta[1:]
+        else:
+            self.intercept_, self.coef_ = 0.0, beta
+
+        return self
+
+    def fit(self, X, y, chunksize=None):
+        '''
+
+        Takes X and y and fits the model from scratch
+
+        chunksize=None accumulates all rows at once, default behavior,
+        while chunksize=n accumulates n rows at a time to bound the memory
+        of polynomial expansion
+
+        '''
+
+        self.reset()
+        if len(y) == 0:
+            raise ValueError('Cannot fit NormalEquationRegressor to 0 rows')
+        chunksize = chunksize or len(y)
+        if chunksize < 1:
+            raise ValueError(f'chunksize must be at least 1, got {chunksize}')
+        for start in range(0, len(y), chunksize):
+            rows = slice(start, start + chunksize)
+            self.partial_fit(X.iloc[rows] if hasattr(X, 'iloc') else X[rows],
+                             y.iloc[rows] if hasattr(y, 'iloc') else y[rows])
+
+        return self
+
+    def fit_chunks(self, chunks, target, features):
+        '''
+
+        Takes iterable of DataFrame chunks, e.g. from acquire.iter_sql or
+        acquire.iter_source, the target column and list of feature columns
+        and accumulates every chunk, skipping rows missing any of them.
+        Statistics already accumulated are kept, so passing only newly
+        acquired rows updates a fitted model
+
+        '''
+
+        for chunk in chunks:
+            chunk = chunk.dropna(subset=list(features) + [target])
+            if len(chunk) > 0:
+                self.partial_fit(chunk[features], chunk[target])
+
+        return self
+
+    def predict(self, X):
+        '''
+
+        Takes X and returns array of predictions
+
+        '''
+
+        check_is_fitted(self, 'coef_')
+        if np.shape(X)[1] != self.n_features_in_:
+            raise ValueError(f'X has {np.shape(X)[1]} features, but '
+                             f'NormalEquationRegressor was fit to '
+                             f'{self.n_features_in_}')
+
+        return self._expand(X) @ self.coef_ + self.intercept_
+
+
 #################### Scale Data #########################
 
 
-def minmax(X_train, X_validate, X_test, features_to_scale=None):
+class MinMaxTransformer:
+    '''
+
+    Scales features to the range of 0 to 1 of the data it was fit to,
+    like sklearn MinMaxScaler, storing only the minimum and range of each
+    feature so it can be reused, saved and loaded for scoring new data
+
+    features=None scales all columns of the DataFrame passed to fit,
+    default behavior
+
+    features=['column'] scales only the listed columns, leaving the rest
+    unchanged
+
+    dtype='float64' returns scaled features as float64, default behavior,
+    and dtype='float32' halves their memory
+
+    '''
+
+    def __init__(self, features=None, dtype='float64'):
+        self.features = features
+        self.dtype = dtype
+
+    def fit(self, X):
+        '''
+
+        Takes DataFrame and stores the fitted features as features_ with
+        the minimum and range of each, leaving features as passed so the
+        scaler can be refit to other data
+
+        '''
+
+        # assign all columns if no features were passed
+        if self.features == None:
+            self.features_ = list(X)
+        else:
+            self.features_ = list(self.features)
+        values = X[self.features_]
+        self.min_ = values.min().to_numpy(dtype='float64')
+        self.range_ = values.max().to_numpy(dtype='float64') - self.min_
+        # leave constant features unscaled as MinMaxScaler does
+        self.range_[self.range_ == 0] = 1
+
+        return self
+
+    def transform_array(self, values):
+        '''
+
+        Takes float NumPy array with one column per feature, in order, and
+        scales it in place, returning the same array
+
+        '''
+
+        values -= self.min_.astype(values.dtype)
+        values /= self.range_.astype(values.dtype)
+
+        return values
+
+    def transform(self, X):
+        '''
+
+        Takes DataFrame and returns it with features scaled, keeping its
+        index and unscaled columns without rebuilding the frame
+
+        '''
+
+        # copy features once into a single block and scale it in place
+        values = X[self.features_].to_numpy(dtype=self.dtype, copy=True)
+        self.transform_array(values)
+        # replace features of shallow copy with scaled block
+        X = X.copy(deep=False)
+        X[self.features_] = values
+
+        return X
+
+    def fit_transform(self, X):
+        '''
+
+        Fits to DataFrame and returns it with features scaled
+
+        '''
+
+        return self.fit(X).transform(X)
+
+    def inverse_transform(self, X):
+        '''
+
+        Takes DataFrame with scaled features and returns it with features
+        in their original units
+
+        '''
+
+        values = X[self.features_].to_numpy(dtype='float64', copy=True)
+        values *= self.range_
+        values += self.min_
+        X = X.copy(deep=False)
+        X[self.features_] = values
+
+        return X
+
+    def to_dict(self):
+        '''
+
+        Returns dictionary of the fitted scaler which can be written as
+        JSON and passed to from_dict
+
+        '''
+
+        return {'features': self.features, 'fitted_features': self.features_,
+                'dtype': self.dtype, 'min': self.min_.tolist(),
+                'range': self.range_.tolist()}
+
+    @classmethod
+    def from_dict(cls, params):
+        '''
+
+        Returns fitted scaler from dictionary created by to_dict
+
+        '''
+
+        scaler = cls(features=params['features'], dtype=params['dtype'])
+        scaler.features_ = list(params.get('fitted_features',
+                                           params['features']))
+        scaler.min_ = np.array(params['min'], dtype='float64')
+        scaler.range_ = np.array(params['range'], dtype='float64')
+
+        return scaler
+
+    def save(self, path):
+        '''
+
+        Writes fitted scaler to path as JSON
+
+        '''
+
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        '''
+
+        Reads fitted scaler from JSON at path
+
+        '''
+
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def minmax(X_train, X_validate, X_test, features_to_scale=None,
+           dtype='float64', return_scaler=False):
     '''
 
     Takes in the X for train, validate, and test and an option list and scales
     all or the list of features using the minmax scaler with default setting,
-    outputs dataframes with all or only list variables scaled
+    outputs dataframes with all or only list variables scaled, with any
+    unscaled variables placed first
+
+    return_scaler=True also returns the fitted MinMaxTransformer so it can
+    be reused or saved for scoring new data
 
     '''
     
-    # check if list of specific features are passed
-    if features_to_scale == None:
-        # assign list of all columns is no list is passed
-        features_to_scale = list(X_train)
-    # create sacler object
-    scaler = MinMaxScaler()
-    # fit scaler to X_train
-    scaler.fit(X_train[features_to_scale])
-    # transform X_train and create new DataFrame for scaled data
-    X_train_scaled = scaler.transform(X_train[features_to_scale])
-    X_train_scaled = pd.DataFrame(X_train_scaled,
-                            columns=features_to_scale).set_index(X_train.index)
-    # combine scaled and unscaled features if list was passed
-    if features_to_scale != None:
-        X_train_scaled = pd.concat((X_train.drop(columns=features_to_scale),
-                            X_train_scaled), axis=1)
-    # transform X_validate and create new DataFrame for scaled data
-    X_validate_scaled = scaler.transform(X_validate[features_to_scale])
-    X_validate_scaled = pd.DataFrame(X_validate_scaled,
-                        columns=features_to_scale).set_index(X_validate.index)
-    # combine scaled and unscaled features if list was passed
-    if features_to_scale != None:
-        X_validate_scaled = pd.concat((X_validate.drop(columns=features_to_scale),
-                        X_validate_scaled), axis=1)
-    # transform X_test and create new DataFrame for scaled data
-    X_test_scaled = scaler.transform(X_test[features_to_scale])
-    X_test_scaled = pd.DataFrame(X_test_scaled,
-                            columns=features_to_scale).set_index(X_test.index)
-    # combine scaled and unscaled features if list was passed
-    if features_to_scale != None:
-        X_test_scaled = pd.concat((X_test.drop(columns=features_to_scale),
-                            X_test_scaled), axis=1)
+    # create scaler object and fit to X_train
+    scaler = MinMaxTransformer(features=features_to_scale, dtype=dtype)
+    scaler.fit(X_train)
+    # place unscaled features before scaled ones
+    columns = ([col for col in X_train if col not in scaler.features_] +
+               scaler.features_)
+    # transform each split, keeping their index
+    X_train_scaled = scaler.transform(X_train)[columns]
+    X_validate_scaled = scaler.transform(X_validate)[columns]
+    X_test_scaled = scaler.transform(X_test)[columns]
+    # check if scaler is returned
+    if return_scaler == True:
+        return X_train_scaled, X_validate_scaled, X_test_scaled, scaler
     
     return X_train_scaled, X_validate_scaled, X_test_scaled
 
@@ -107,16 +581,88 @@ def minmax(X_train, X_validate, X_test, features_to_scale=None):
 #################### Explore Features ####################
 
 
+@stage('univariate_scores')
+def univariate_scores(X, y):
+    '''
+
+    Takes in the X, y train and returns a DataFrame indexed by feature with
+    its f_regression score and p value. Memoized by the content of X and y,
+    so every k can be answered from one computation without RFE
+
+    '''
+
+    f_score, f_p = f_regression(X, np.asarray(y).ravel())
+
+    return pd.DataFrame({'f_score': f_score, 'f_p': f_p}, index=X.columns)
+
+
+@stage('rank_features')
+def rank_features(X, y, model=None, cv=None, n_jobs=None):
+    '''
+
+    Takes in the X, y train and an optional model and returns a DataFrame
+    indexed by feature with its f_regression score and p value and its
+    full RFE ranking, where rank n means the feature is kept by RFE down
+    to n features. Memoized by the content of X, y and the model
+    parameters, so every k or n can be answered from one computation
+
+    model=None uses LinearRegression, default behavior
+
+    cv=None skips cross validation, default behavior
+
+    cv=int or splitter also runs RFECV across n_jobs processes, adding
+    whether each feature is in the cross validated best set
+
+    '''
+
+    # assign model if none passed
+    if model == None:
+        model = LinearRegression()
+    # univariate scores of every feature
+    df = univariate_scores(X, y)
+    y = np.asarray(y).ravel()
+    # eliminate down to one feature to rank every feature at once
+    selector = RFE(estimator=clone(model), n_features_to_select=1).fit(X, y)
+    df['rfe_rank'] = selector.ranking_
+    # check if cross validated elimination is requested
+    if cv != None:
+        selector = RFECV(estimator=clone(model), cv=cv, n_jobs=n_jobs)
+        df['rfecv_selected'] = selector.fit(X, y).support_
+
+    return df
+
+
 def select_kbest(X, y, k=1, score_func=f_regression):
     '''
 
     Takes in the X, y train and an optional k values and score_func to use
     SelectKBest to return k (default=1) best variables for predicting the
     target of y
+
+    With the default f_regression the answer is looked up from the cached
+    scores of univariate_scores instead of recomputed
     
     '''
 
-    # assign SelectKBest using f_regression and top two features default
+    # check if cached scores can be used
+    if score_func == f_regression:
+        # validate k as SelectKBest does
+        if k != 'all' and k < 0:
+            raise ValueError(f"k should be >= 0, <= n_features = "
+                             f"{X.shape[1]}; got {k}. Use k='all' to return "
+                             "all features.")
+        if k != 'all' and k > X.shape[1]:
+            warnings.warn(f'k={k} is greater than n_features={X.shape[1]}. '
+                          'All the features will be returned.')
+        if k == 'all' or k >= X.shape[1]:
+            return X.columns.to_list()
+        scores = univariate_scores(X, y).f_score.to_numpy()
+        # keep k highest scores, breaking ties as SelectKBest does
+        mask = np.zeros(len(scores), dtype=bool)
+        if k > 0:
+            mask[np.argsort(scores, kind='mergesort')[-k:]] = True
+        return X.columns[mask].to_list()
+    # assign SelectKBest using score_func and top k features
     selector = SelectKBest(score_func=score_func, k=k)
     # fit selector to training set
     selector.fit(X, y)
@@ -126,7 +672,7 @@ def select_kbest(X, y, k=1, score_func=f_regression):
     return top_k
 
 
-def select_rfe(X, y, n=1, model=LinearRegression(), rank=False):
+def select_rfe(X, y, n=1, model=None, rank=False):
     '''
 
     Takes in the X, y train and an optional n values and model to use with
@@ -134,19 +680,21 @@ def select_rfe(X, y, n=1, model=LinearRegression(), rank=False):
     target of y, optionally can be used to output ranks of features in
     predictions
 
+    model=None uses LinearRegression, default behavior
+
+    The answer is looked up from the cached full ranking of rank_features,
+    so other values of n do not refit RFE
+
     '''
 
-    # assign RFE using LinearRegression and top two features as default
-    selector = RFE(estimator=model, n_features_to_select=n)
-    # fit selector to training set
-    selector.fit(X, y)
-    # assign and apply mask to DataFrame for column names
-    mask = selector.get_support()
-    top_n = X.columns[mask].to_list()
+    # obtain full ranking, where n best features have rank n or lower
+    ranking = rank_features(X, y, model=model).rfe_rank
+    top_n = X.columns[ranking <= n].to_list()
     # check if rank=True
     if rank == True:
-        # print DataFrame of rankings
-        print(pd.DataFrame(X.columns, selector.ranking_,
+        # print DataFrame of rankings as RFE to n features reports them
+        ranks = np.maximum(ranking.to_numpy() - n + 1, 1)
+        print(pd.DataFrame(X.columns, ranks,
                            [f'n={n} RFE Rankings']).sort_index())
     return top_n
 
@@ -162,43 +710,84 @@ def get_metrics(true, predicted, display=False):
 
     '''
     
-    rmse = mean_squared_error(true, predicted) ** 0.5
-    r2 = explained_variance_score(true, predicted)
+    # compute both scores from one pass over the residuals
+    metrics = compute_metrics(true, predicted)
+    rmse = metrics['RMSE'][0]
+    r2 = metrics['explained_variance'][0]
     if display == True:
         print(f'Model RMSE: {rmse:.2g}')
         print(f'       R^2: {r2:.2g}')
     return rmse, r2
 
 
-def plot_residuals(y_true, y_predicted):
+# marker styles of the first four models' residuals, with later models
+# cycling through the default color palette
+RESIDUAL_STYLES = [
+    {'color':'cyan', 'alpha':1, 'edgecolors':'black'},
+    {'color':'magenta', 'alpha':0.75, 'edgecolors':'black'},
+    {'color':'yellow', 'alpha':0.75, 'edgecolors':'black'},
+    {'color':'black', 'alpha':0.5, 'edgecolors':'white'},
+]
+
+
+def plot_residuals(y_true, y_predicted, kind='scatter', max_points=None,
+                   random_state=19):
     '''
 
-    Takes in 1 to 4 prediction sets and returns a configured scatterplot of the
-    residual errors of those predictions against the passed true set
+    Takes in any number of prediction sets and returns a configured
+    scatterplot of the residual errors of those predictions against the
+    passed true set
+
+    kind='scatter' plots residual points of every model on one plot,
+    default behavior
+
+    kind='hex' plots the density of residuals of each model in hexagonal
+    bins on its own subplot, drawing every row at a fixed cost
+
+    max_points=None plots every row when kind='scatter', default behavior
+
+    max_points=n plots the residuals of at most n rows sampled across the
+    range of true values, the same rows for every model
     
     '''
 
+    # obtain residuals of every model
+    residuals = y_predicted.sub(y_true, axis=0)
+    if kind == 'hex':
+        # plot one density subplot per model
+        n_models = len(residuals.columns)
+        n_cols = min(n_models, 2)
+        n_rows = ceil(n_models / n_cols)
+        plt.figure(figsize=(30 * n_cols, 20 * n_rows))
+        for i, col in enumerate(residuals):
+            plt.subplot(n_rows, n_cols, i + 1)
+            plt.hexbin(y_true, residuals[col], gridsize=100, bins='log',
+                       cmap='viridis', mincnt=1)
+            plt.axhline(color='red', linewidth=5, linestyle='dashed',
+                        alpha=0.25)
+            plt.title(f'\n{col}\n', fontsize=50)
+            plt.xlabel('\nTrue Value\n', fontsize=50)
+            plt.ylabel('\nPredicted Value Error\n', fontsize=50)
+        plt.suptitle(f'\nPrediction Residuals of {y_true.name}\n',
+                     fontsize=50)
+        plt.show()
+        return
+    # sample the same rows for every model
+    frame = residuals.assign(_true=y_true)
+    frame = decimate(frame, max_points=max_points, by='_true',
+                     random_state=random_state)
     # set figure dimensions
     plt.figure(figsize=(60, 40))
     plt.rcParams['legend.title_fontsize'] = 50
-    # scatterplot for each up to four predictions passed in list
-    plt.scatter(y_true, (y_predicted.iloc[0:,0] - y_true), alpha=1,
-                    color='cyan', s=250, label=y_predicted.iloc[0:,0].name,
-                    edgecolors='black')
-    if len(y_predicted.columns) > 1:
-        plt.scatter(y_true, (y_predicted.iloc[0:,1] - y_true), alpha=0.75, 
-                    color='magenta', s=250, label=y_predicted.iloc[0:,1].name, 
-                    edgecolors='black')
-    if len(y_predicted.columns) > 2:
-        plt.scatter(y_true, (y_predicted.iloc[0:,2] - y_true), alpha=0.75, 
-                    color='yellow', s=250, label=y_predicted.iloc[0:,2].name, 
-                    edgecolors='black')
-    if len(y_predicted.columns) > 3:
-        plt.scatter(y_true, (y_predicted.iloc[0:,3] - y_true), alpha=0.5, 
-                    color='black', s=250, label=y_predicted.iloc[0:,3].name, 
-                    edgecolors='white')
-    if len(y_predicted.columns) > 4:
-        return 'Can only plot up to four models\' predictions'
+    # scatterplot for each prediction passed
+    palette = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    for i, col in enumerate(residuals):
+        if i < len(RESIDUAL_STYLES):
+            style = RESIDUAL_STYLES[i]
+        else:
+            style = {'color':palette[i % len(palette)], 'alpha':0.5,
+                     'edgecolors':'black'}
+        plt.scatter(frame._true, frame[col], s=250, label=col, **style)
     # add zero line for ease of readability
     plt.axhline(label='', color='red', linewidth=5, linestyle='dashed',
                     alpha=0.25)
@@ -4,21 +4,260 @@
 # import from python libraries and modules
 import pandas as pd
 import numpy as np
+import warnings
 import matplotlib.pyplot as plt
 from math import ceil
-import scipy.stats as stats
+from functools import lru_cache
+from os.path import dirname, join
 
 # import data manipulation tools
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import MinMaxScaler
 
 # import from created modules
-from acquire import acquire_mvp, get_sql
+from acquire import acquire_mvp, apply_schema, get_sql
+from spatial import add_neighbor_features
+from stages import stage
+from streaming import merge_moments
+from summary import summarize
+
+
+# FIPS reference table bundled with project
+FIPS_TABLE = join(dirname(__file__), 'fips_codes.csv')
 
 
 #################### Prepare Data ####################
 
 
+@lru_cache(maxsize=None)
+def get_fips_table(path=FIPS_TABLE):
+    '''
+
+    Reads FIPS reference table with fips and county columns from path,
+    defaulting to the table of California counties bundled with the
+    project, and returns it indexed by fips code. Read only once per path
+
+    '''
+
+    # read reference table and index by code
+    table = pd.read_csv(path, dtype={'fips':'int64', 'county':'string'})
+    table = table.set_index('fips')
+
+    return table
+
+
+def map_fips(fips, path=FIPS_TABLE, unknown='Unknown'):
+    '''
+
+    Takes Series of numeric fips codes and returns a categorical Series of
+    county names in a single vectorized lookup against the FIPS reference
+    table at path
+
+    Codes missing from the reference table are named with unknown
+    (default='Unknown') and reported with a warning so they can be added
+    to the table, or filtered or raised with the warnings module. Null
+    codes are returned as null county names
+
+    '''
+
+    # look up position of every code in reference table at once, with
+    # null codes looked up as -1 so they match no county
+    table = get_fips_table(path)
+    null = fips.isna().to_numpy()
+    codes = table.index.get_indexer(
+                    fips.to_numpy(dtype='float64', na_value=-1)
+                    .astype('int64'))
+    # check for codes absent from reference table
+    missing = (codes == -1) & ~null
+    categories = table.county.to_list()
+    if missing.any():
+        warnings.warn(f'Unknown fips codes: '
+                      f'{sorted(set(fips[missing].tolist()))}', stacklevel=2)
+        categories.append(unknown)
+        codes[missing] = len(categories) - 1
+    # build categorical directly from looked up positions, keeping only
+    # counties present in data
+    county = pd.Series(pd.Categorical.from_codes(codes, categories),
+                       index=fips.index, name='county')
+    county = county.cat.remove_unused_categories()
+
+    return county
+
+
+class OutlierFilter:
+    '''
+
+    Fits the mean and population standard deviation of each column once
+    and removes rows with values z (default=3) or more standard
+    deviations from the mean using those stored bounds, so new data can
+    be filtered without recomputing statistics over the full history
+
+    exclude=None will check all numeric columns, default behavior
+
+    Can pass column name or list of column names as 'strings' to
+    exclude from checking
+
+    Statistics can be accumulated over chunks with partial_fit, merging
+    each chunk into the running mean and sum of squared deviations in a
+    single pass (Welford / Chan et al.)
+
+    '''
+
+    def __init__(self, z=3, exclude=None):
+        self.z = z
+        # accept single column name or list of names
+        if exclude == None:
+            exclude = []
+        elif isinstance(exclude, str):
+            exclude = [exclude]
+        self.exclude = list(exclude)
+        self.reset()
+
+    def reset(self):
+        '''
+
+        Forgets all fitted statistics
+
+        '''
+
+        self.columns_ = None
+        self.n_ = 0
+        self.mean_ = None
+        self.m2_ = None
+
+    def partial_fit(self, df):
+        '''
+
+        Takes DataFrame chunk and merges its statistics into the running
+        mean and sum of squared deviations of each checked column
+
+        '''
+
+        # assign checked columns on first chunk
+        if self.columns_ == None:
+            self.columns_ = [col for col in df.select_dtypes('number')
+                             if col not in self.exclude]
+        values = df[self.columns_].to_numpy(dtype='float64')
+        n = len(values)
+        if n == 0:
+            return self
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+        # merge chunk statistics into running statistics
+        if self.n_ == 0:
+            self.n_, self.mean_, self.m2_ = n, mean, m2
+        else:
+            self.n_, self.mean_, self.m2_ = merge_moments(
+                            self.n_, self.mean_, self.m2_, n, mean, m2)
+
+        return self
+
+    def fit(self, df):
+        '''
+
+        Takes DataFrame, or an iterable of DataFrame chunks, and fits the
+        mean and standard deviation of each checked column
+
+        '''
+
+        self.reset()
+        # fit in one pass over single frame or each chunk
+        chunks = [df] if isinstance(df, pd.DataFrame) else df
+        for chunk in chunks:
+            self.partial_fit(chunk)
+
+        return self
+
+    @property
+    def std_(self):
+        # population standard deviation matching scipy.stats.zscore
+        return np.sqrt(self.m2_ / self.n_)
+
+    @property
+    def bounds_(self):
+        '''
+
+        DataFrame of the lower and upper bound of each checked column,
+        exclusive of the bounds themselves
+
+        '''
+
+        return pd.DataFrame({'lower': self.mean_ - self.z * self.std_,
+                             'upper': self.mean_ + self.z * self.std_},
+                            index=self.columns_)
+
+    def mask(self, df):
+        '''
+
+        Takes DataFrame and returns boolean array marking rows with every
+        checked column strictly within the fitted bounds
+
+        '''
+
+        # compare one column at a time against its stored bounds
+        lower = self.mean_ - self.z * self.std_
+        upper = self.mean_ + self.z * self.std_
+        keep = np.ones(len(df), dtype=bool)
+        for i, col in enumerate(self.columns_):
+            values = df[col].to_numpy()
+            keep &= (values > lower[i]) & (values < upper[i])
+
+        return keep
+
+    def transform(self, df):
+        '''
+
+        Takes DataFrame and returns only rows within the fitted bounds
+
+        '''
+
+        return df[self.mask(df)]
+
+    def fit_transform(self, df):
+        '''
+
+        Fits bounds to DataFrame and returns only its rows within them
+
+        '''
+
+        return self.fit(df).transform(df)
+
+    def select(self, columns):
+        '''
+
+        Returns copy of fitted filter checking only those of its columns
+        that are in columns, e.g. the features of a model
+
+        '''
+
+        keep = [i for i, col in enumerate(self.columns_) if col in columns]
+        outliers = type(self)(z=self.z, exclude=self.exclude)
+        outliers.columns_ = [self.columns_[i] for i in keep]
+        outliers.n_ = self.n_
+        outliers.mean_ = self.mean_[keep]
+        outliers.m2_ = self.m2_[keep]
+
+        return outliers
+
+    @classmethod
+    def from_bounds(cls, bounds, z=3):
+        '''
+
+        Takes dictionary of column to (lower, upper) bounds, e.g. from
+        acquire.zscore_bounds, and returns OutlierFilter applying them
+
+        '''
+
+        outliers = cls(z=z)
+        lower, upper = np.array(list(bounds.values()), dtype='float64').T
+        # store mean and spread that reproduce the passed bounds
+        outliers.columns_ = list(bounds)
+        outliers.n_ = 1
+        outliers.mean_ = (lower + upper) / 2
+        outliers.m2_ = ((upper - lower) / (2 * z)) ** 2
+
+        return outliers
+
+
 def shed_zscore_outliers(df, exclude=None):
     '''
     
@@ -29,21 +268,15 @@ def shed_zscore_outliers(df, exclude=None):
     
     Can pass column name or list of column names as 'strings' to
     exclude from checking z-scores
+
+    Use OutlierFilter directly to keep the fitted bounds for new data
     
     '''
-    
-    # check if any columns are to be excluded
-    if exclude == None:
-        # reassign DataFrame with all values more than 3 standard
-        # deviations from mean
-        df = df[(np.abs(stats.zscore(df)) < 3).all(axis=1)]
-        return df
-    else:
-        # assign DataFrame with non-excluded values more than 3
-        # standard deviations from mean
-        df = df[(np.abs(
-            stats.zscore(df.loc[:, df.columns != exclude])) < 3).all(axis=1)]
-        return df
+
+    # fit bounds and remove rows outside of them
+    df = OutlierFilter(exclude=exclude).fit_transform(df)
+
+    return df
 
 
 def make_dummies(df, cols):
@@ -60,23 +293,102 @@ def make_dummies(df, cols):
     return df
 
 
-def split_data(df, target):
+def _shuffle_split(positions, test_size, rng):
+    '''
+
+    Splits array of row positions into train and test positions the same
+    way as sklearn train_test_split, so that the same random_state gives
+    the same rows
+
+    '''
+
+    # test rows are the first ceil(n * test_size) of one permutation
+    n_test = ceil(test_size * len(positions))
+    permutation = rng.permutation(len(positions))
+
+    return positions[permutation[n_test:]], positions[permutation[:n_test]]
+
+
+def split_indices(n, test_size=0.2, validate_size=0.25, random_state=19,
+                  stratify=None):
     '''
+
+    Takes number of rows and returns arrays of row positions for train,
+    validate, and test without touching any data. test_size is the share
+    of all rows held out for test and validate_size the share of the
+    remaining rows held out for validate, by default a 60/20/20 split
+    matching the positions sklearn train_test_split would select
+
+    stratify=None shuffles all rows together, default behavior
+
+    stratify=array-like of group labels splits each group separately so
+    that every split keeps the group proportions
+
+    '''
+
+    # check if rows are split within groups
+    if stratify is None:
+        groups = [np.arange(n)]
+    else:
+        codes = pd.factorize(np.asarray(stratify))[0]
+        groups = [np.flatnonzero(codes == code) for code in np.unique(codes)]
+    train, validate, test = [], [], []
+    for positions in groups:
+        # hold out test rows, then validate rows from remainder
+        train_validate, group_test = _shuffle_split(
+                    positions, test_size, np.random.RandomState(random_state))
+        group_train, group_validate = _shuffle_split(
+                    train_validate, validate_size,
+                    np.random.RandomState(random_state))
+        train.append(group_train)
+        validate.append(group_validate)
+        test.append(group_test)
+
+    return np.concatenate(train), np.concatenate(validate), np.concatenate(test)
+
+
+def take_split(df, target, positions):
+    '''
+
+    Takes DataFrame, target column name and array of row positions from
+    split_indices and returns the X and y for those rows. The same
+    positions can be reused with any DataFrame holding the same rows
+
     '''
 
-    # assign X, y
+    # select rows once and separate features from target
+    df = df.iloc[positions]
     X = df.drop(columns=target)
-    y = pd.DataFrame(df[target])
-    # split X data into train, validate, and test datasets
-    X_train_validate, X_test = train_test_split(X, test_size=0.2, 
-                                            random_state=19)
-    X_train, X_validate = train_test_split(X_train_validate, test_size=0.25,
-                                            random_state=19)
-    # split y data into train, validate, and test datasets
-    y_train_validate, y_test = train_test_split(y, test_size=0.2, 
-                                            random_state=19)
-    y_train, y_validate = train_test_split(y_train_validate, test_size=0.25,
-                                            random_state=19)
+    y = df[[target]]
+
+    return X, y
+
+
+@stage('split_data')
+def split_data(df, target, stratify=None):
+    '''
+
+    Takes DataFrame and target column name and splits it into X, y for
+    train (60%), validate (20%), and test (20%) using random_state=19,
+    returning a DataFrame of the train rows for exploration followed by
+    the six splits. Memoized by the content of the passed data
+
+    stratify=None shuffles all rows together, default behavior
+
+    stratify='column' or array-like of group labels keeps the proportions
+    of each group equal across splits
+
+    '''
+
+    # check if stratifying by column of DataFrame
+    if isinstance(stratify, str):
+        stratify = df[stratify]
+    # obtain row positions for each split without copying any data
+    train, validate, test = split_indices(len(df), stratify=stratify)
+    # select rows for each split from original DataFrame
+    X_train, y_train = take_split(df, target, train)
+    X_validate, y_validate = take_split(df, target, validate)
+    X_test, y_test = take_split(df, target, test)
     # create explore DataFrame using train data
     df = pd.concat((X_train, y_train), axis=1)
 
@@ -86,30 +398,92 @@ def split_data(df, target):
             X_test, y_test)
 
 
-def prepare_mvp(use_csv=False):
+@stage('fit_mvp_outliers')
+def fit_mvp_outliers(df):
     '''
 
-    Takes the DataFrame from acquire_mvp function and prepares a DataFrame to
-    obtain and explore the project MVP, converting the fips column into human
-    readable county names
-    
+    Takes DataFrame from acquire_mvp and returns OutlierFilter fitted to
+    3 stdev bounds of every column but fips. Memoized by the content of
+    the passed data
+
+    '''
+
+    return OutlierFilter(exclude='fips').fit(df)
+
+
+@stage('remove_mvp_outliers')
+def remove_mvp_outliers(df):
+    '''
+
+    Takes DataFrame from acquire_mvp and removes rows with values more
+    than 3 stdev from the mean of any column but fips, then rows with 0
+    bedrooms or bathrooms. Memoized by the content of the passed data
+
     '''
 
-    # acquire mvp data from database
-    df = acquire_mvp(use_csv=use_csv)
     # remove outliers more than 3 stdev from mean
-    df = shed_zscore_outliers(df, exclude='fips')
+    df = fit_mvp_outliers(df).transform(df)
     # remove 0 values from bedrooms and bathrooms
     df = df.loc[((df.bedrooms != 0) & (df.bathrooms != 0))]
-    # replace fips numerical codes with string county names and rename column
-    df.fips = np.where(df.fips == 6037.0, 'Los Angeles', df.fips)
-    df.fips = np.where(df.fips == '6059.0', 'Orange', df.fips)
-    df.fips = np.where(df.fips == '6111.0', 'Ventura', df.fips)
+
+    return df
+
+
+@stage('map_mvp_county')
+def map_mvp_county(df):
+    '''
+
+    Takes DataFrame with fips column and replaces it with a county column
+    of human readable county names. Memoized by the content of the passed
+    data
+
+    '''
+
+    # replace fips numerical codes with county names and rename column,
+    # on a copy so the passed data is unchanged
+    df = df.assign(fips=map_fips(df.fips))
     df = df.rename(columns=({'fips':'county'}))
 
     return df
 
 
+def prepare_mvp(use_csv=False, pushdown=False, return_filter=False):
+    '''
+
+    Takes the DataFrame from acquire_mvp function and prepares a DataFrame to
+    obtain and explore the project MVP, converting the fips column into human
+    readable county names
+
+    Each stage is memoized by the content of its input, so calling this
+    again in the same session only reruns stages whose input changed
+
+    pushdown=True has the database remove outliers and 0 bedroom or
+    bathroom rows during acquisition instead of removing them here
+
+    return_filter=True also returns the fitted OutlierFilter holding the
+    outlier bounds, so it can be registered with a model and applied to
+    new data when scoring
+    
+    '''
+
+    # acquire mvp data from database with any bounds it filtered by
+    df, bounds = acquire_mvp(use_csv=use_csv, pushdown=pushdown,
+                             return_bounds=True)
+    # check if outliers were already removed by database
+    if pushdown == False:
+        outliers = fit_mvp_outliers(df)
+        df = remove_mvp_outliers(df)
+    else:
+        outliers = OutlierFilter.from_bounds(bounds)
+    # replace fips numerical codes with county names
+    df = map_mvp_county(df)
+    # check if outlier filter is returned
+    if return_filter == True:
+        return df, outliers
+
+    return df
+
+
 #################### Visualize Data ####################
 
 
@@ -117,10 +491,13 @@ def show_distributions(df):
     '''
 
     Plots the distrubtion for all columns within dataframe and automatically
-    scaled dimensions to the number of required subplots
+    scaled dimensions to the number of required subplots, drawing numeric
+    columns from their precomputed summary
     
     '''
 
+    # obtain precomputed binned counts for data
+    summary = summarize(df)
     # define dimensions for subplots
     n_rows = ceil(len(list(df)) / 4)
     n_cols = 4
@@ -131,7 +508,12 @@ def show_distributions(df):
     for col in list(df):
         n_plot += 1
         plt.subplot(n_rows, n_cols, n_plot)
-        plt.hist(x=df[col])
+        # plot numeric columns from binned counts
+        if col in summary.histograms:
+            counts, edges = summary.histograms[col]
+            plt.hist(edges[:-1], bins=edges, weights=counts)
+        else:
+            plt.hist(x=df[col])
         plt.title('')
         plt.xlabel(col)
         plt.xscale('linear')
@@ -164,11 +546,25 @@ ORDER BY
 ;'''
 
 
-def wrangle_zillow(use_csv=True):
+def wrangle_zillow(use_csv=True, neighbors=None):
+    '''
+
+    Acquires and prepares the properties of query and returns X, y for
+    train, validate and test
+
+    neighbors=None uses location only through latzip and lonzip, default
+    behavior
+
+    neighbors=k also adds features of the k nearest train properties of
+    every property, see spatial.add_neighbor_features
+
+    '''
+
     # get 
     df = get_sql(query, 'zillow', use_csv=use_csv)
     df = df.dropna()
     df = df.set_index('property_id')
+    df = apply_schema(df)
     df['latzip'] = df.latitude / df.regionidzip
     df['lonzip'] = df.longitude / df.regionidzip
     df = shed_zscore_outliers(df)
@@ -177,5 +573,9 @@ def wrangle_zillow(use_csv=True):
     X_train, y_train, \
     X_validate, y_validate, \
     X_test, y_test = split_data(df, 'taxvaluedollarcnt')
+    # add neighborhood features from train properties only
+    if neighbors != None:
+        X_train, X_validate, X_test = add_neighbor_features(
+                        X_train, y_train, X_validate, X_test, k=neighbors)
 
     return X_train, y_train, X_validate, y_validate, X_test, y_test
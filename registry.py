@@ -0,0 +1,213 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import json
+import pickle
+from datetime import datetime, timezone
+from os import listdir, makedirs, replace
+from os.path import isdir, isfile, join
+from threading import Lock
+
+# import from created modules
+from stages import fingerprint
+
+
+# directory holding registered models, one subdirectory per model name
+REGISTRY_DIR = 'models'
+
+# records already loaded this session by directory
+_records = {}
+_records_lock = Lock()
+
+
+#################### Register Models ####################
+
+
+class ModelRecord:
+    '''
+
+    A registered model version. Its metadata is read when the record is
+    loaded, while the fitted estimator, scaler and any other artifacts
+    are only unpickled the first time one of them is accessed
+
+    meta: dictionary with name, version, created time, estimator, list of
+    features, fingerprint of training data, metrics and fitted scaler
+
+    '''
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self._artifacts = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"ModelRecord('{self.meta['name']}', v{self.meta['version']})"
+
+    @property
+    def artifacts(self):
+        '''
+
+        Dictionary of every pickled artifact, loaded on first access
+
+        '''
+
+        with self._lock:
+            if self._artifacts == None:
+                with open(join(self.path, 'artifacts.pkl'), 'rb') as f:
+                    self._artifacts = pickle.load(f)
+
+        return self._artifacts
+
+    @property
+    def model(self):
+        return self.artifacts['model']
+
+    @property
+    def scaler(self):
+        return self.artifacts.get('scaler')
+
+    @property
+    def features(self):
+        return self.meta['features']
+
+    def predict(self, X):
+        '''
+
+        Takes DataFrame of raw features and returns predictions, scaling
+        with the registered scaler first if one was saved
+
+        '''
+
+        # select and scale registered features
+        X = X[self.features]
+        if self.scaler is not None:
+            X = self.scaler.transform(X)
+
+        return self.model.predict(X)
+
+
+def _model_dir(name):
+    return join(REGISTRY_DIR, name)
+
+
+def _versions(name):
+    '''
+
+    Returns sorted list of registered version numbers of model name
+
+    '''
+
+    # check if model has been registered
+    if isdir(_model_dir(name)) == False:
+        return []
+    versions = sorted(int(entry[1:]) for entry in listdir(_model_dir(name))
+                      if entry.startswith('v') and entry[1:].isdigit())
+
+    return versions
+
+
+def save_model(name, model, features, scaler=None, data=None, metrics=None,
+               **artifacts):
+    '''
+
+    Takes model name, fitted estimator and list of feature names and
+    registers them as the next version of that model, returning its
+    ModelRecord
+
+    scaler=fitted scaler is saved so predictions can scale raw features
+
+    data=DataFrame or tuple of (X, y) the model was fit to records its
+    fingerprint so models can be looked up by training data
+
+    metrics=dictionary of performance metrics records them with the model
+
+    Any other keyword arguments are pickled with the model as artifacts,
+    e.g. a fitted outlier filter used to prepare the data
+
+    '''
+
+    # assign next version number of model
+    version = (_versions(name) or [0])[-1] + 1
+    path = join(_model_dir(name), f'v{version}')
+    meta = {
+        'name': name,
+        'version': version,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'estimator': repr(model),
+        'features': list(features),
+        'fingerprint': fingerprint(data) if data is not None else None,
+        'metrics': {key: (value if isinstance(value, str) else float(value))
+                    for key, value in (metrics or {}).items()},
+        'scaler': scaler.to_dict() if hasattr(scaler, 'to_dict') else None,
+        'artifacts': sorted(artifacts),
+    }
+    # write to temporary directory then swap into place
+    tmp_path = f'{path}.tmp'
+    makedirs(tmp_path, exist_ok=True)
+    with open(join(tmp_path, 'artifacts.pkl'), 'wb') as f:
+        pickle.dump({'model': model, 'scaler': scaler, **artifacts}, f)
+    with open(join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    replace(tmp_path, path)
+
+    return load_model(name, version)
+
+
+def load_model(name, version=None):
+    '''
+
+    Takes model name and returns the ModelRecord of the passed version,
+    or of the latest version if none is passed. Records are kept for the
+    session so loading the same version again returns the same record
+
+    '''
+
+    # assign latest version if none passed
+    if version == None:
+        versions = _versions(name)
+        if len(versions) == 0:
+            raise KeyError(f'No registered model named {name}')
+        version = versions[-1]
+    path = join(_model_dir(name), f'v{version}')
+    with _records_lock:
+        if path not in _records:
+            if isfile(join(path, 'meta.json')) == False:
+                raise KeyError(f'No version {version} of model {name}')
+            with open(join(path, 'meta.json')) as f:
+                _records[path] = ModelRecord(path, json.load(f))
+
+    return _records[path]
+
+
+def list_models(name=None, data=None):
+    '''
+
+    Returns DataFrame of metadata of every registered model version,
+    without loading any model
+
+    name='model' lists only versions of that model
+
+    data=DataFrame or tuple of (X, y) lists only versions fit to that data
+
+    '''
+
+    # check if registry exists
+    if isdir(REGISTRY_DIR) == False:
+        return pd.DataFrame()
+    names = [name] if name != None else sorted(listdir(REGISTRY_DIR))
+    rows = []
+    for model_name in names:
+        for version in _versions(model_name):
+            meta = load_model(model_name, version).meta
+            rows.append({key: value for key, value in meta.items()
+                         if key not in ('metrics', 'scaler')}
+                        | meta['metrics'])
+    df = pd.DataFrame(rows)
+    # filter by fingerprint of training data
+    if data is not None and len(df) > 0:
+        df = df[df.fingerprint == fingerprint(data)]
+
+    return df
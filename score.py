@@ -0,0 +1,144 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+from os.path import isdir
+from shutil import rmtree
+
+# import from created modules
+from acquire import apply_schema, iter_source, iter_sql_cached, mvp_query
+from acquire import write_part
+from metrics import MetricsAccumulator
+from prepare import map_fips
+from registry import load_model
+
+
+#################### Score Properties ####################
+
+
+def prepare_chunk(df, record):
+    '''
+
+    Takes DataFrame chunk of raw property rows and registered ModelRecord
+    and prepares the chunk for prediction: indexing by property_id,
+    dropping rows missing any feature, applying compact dtypes, removing
+    rows with a feature outside the fitted outlier bounds saved with the
+    model as the 'outliers' artifact (see model.train_model), and mapping
+    fips codes to county names
+
+    Only the model features are checked, so properties without a known
+    tax amount or value are still scored, and unlike prepare_mvp rows
+    with 0 bedrooms or bathrooms are not removed
+
+    '''
+
+    # index by property and drop rows that cannot be scored
+    if 'property_id' in df:
+        df = df.set_index('property_id')
+    df = df.dropna(subset=record.features)
+    df = apply_schema(df)
+    # apply stored outlier bounds without refitting
+    outliers = record.artifacts.get('outliers')
+    if outliers is not None:
+        df = outliers.select(record.features).transform(df)
+    # replace fips codes with county names
+    if 'fips' in df:
+        df = df.assign(county=map_fips(df.fips)).drop(columns='fips')
+
+    return df
+
+
+def score_chunks(chunks, record, target=None):
+    '''
+
+    Takes iterable of DataFrame chunks of raw property rows and registered
+    ModelRecord and yields a DataFrame of predictions for each chunk,
+    holding property_id, county where available and the prediction
+
+    target='column' also keeps the true values of that column next to
+    each prediction
+
+    '''
+
+    for chunk in chunks:
+        df = prepare_chunk(chunk, record)
+        # skip chunks with no rows left to score
+        if len(df) == 0:
+            continue
+        # predict with registered scaler and model
+        predictions = pd.DataFrame(
+                {'prediction': np.asarray(record.predict(df),
+                                          dtype='float64').ravel()},
+                index=df.index)
+        if 'county' in df:
+            # store plain strings so every part shares one schema
+            predictions.insert(0, 'county', df.county.astype(str))
+        if target != None:
+            predictions[target] = df[target]
+        yield predictions.reset_index()
+
+
+def score(model_name, source=None, output='predictions', version=None,
+          chunksize=100_000, use_csv=True, target=None, bands=None):
+    '''
+
+    Takes name of a registered model and scores property rows from source
+    chunk by chunk, writing the predictions of each chunk as a part of the
+    output directory as it goes, so any number of properties are scored
+    with memory bounded by one chunk. Returns the number of rows read and
+    the number scored
+
+    source=None streams the properties of the MVP query cache, acquiring
+    it in chunks first if it does not exist, default behavior
+
+    source='path' streams rows from a cache directory, parquet or CSV file
+
+    version=None uses the latest registered version of the model, default
+    behavior
+
+    target='column' also accumulates metrics of the predictions against
+    the true values of that column while scoring, e.g. 'tax_value_usd',
+    returned under 'metrics' as a DataFrame broken down by county and, if
+    bands=[edges] is passed, by those value bands (see metrics.evaluate)
+
+    The output directory holds parquet parts (pickle if pyarrow is not
+    installed) and can be read with acquire.read_cache or, for parquet,
+    pd.read_parquet
+
+    '''
+
+    # load registered model and choose reader for source
+    record = load_model(model_name, version)
+    if source == None:
+        chunks = iter_sql_cached(mvp_query, 'zillow', use_csv=use_csv,
+                                 chunksize=chunksize)
+    else:
+        chunks = iter_source(source, chunksize=chunksize)
+    # count rows read while streaming
+    counts = {'read': 0, 'scored': 0}
+
+    def counted(chunks):
+        for chunk in chunks:
+            counts['read'] += len(chunk)
+            yield chunk
+
+    # replace any earlier output
+    if isdir(output):
+        rmtree(output)
+    metrics = MetricsAccumulator(bands=bands) if target != None else None
+    for part, predictions in enumerate(score_chunks(counted(chunks), record,
+                                                    target=target)):
+        write_part(predictions, output, part)
+        counts['scored'] += len(predictions)
+        # merge metrics of chunk by county
+        if metrics is not None:
+            metrics.update(predictions[target],
+                           predictions[['prediction']].rename(
+                               columns={'prediction': model_name}),
+                           by=predictions.get('county'))
+    if metrics is not None:
+        counts['metrics'] = metrics.summary()
+
+    return counts
@@ -0,0 +1,329 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+import json
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from time import perf_counter
+
+# import from created modules
+from registry import load_model
+
+
+#################### Predict Properties ####################
+
+
+class LinearPredictor:
+    '''
+
+    Holds a fitted linear or polynomial regression model as plain NumPy
+    arrays, with scaling and polynomial expansion precomputed, so single
+    properties and small batches are predicted without pandas or sklearn
+    on the hot path
+
+    features: list of feature names in the order values are passed
+
+    coef, intercept: coefficients of the expanded features and intercept
+
+    min_, range_: minmax scaling of the raw features, or None if unscaled
+
+    powers: array with one row of feature exponents per expanded feature,
+    or None if the model uses the raw features directly
+
+    '''
+
+    def __init__(self, features, coef, intercept, min_=None, range_=None,
+                 powers=None):
+        self.features = list(features)
+        self.coef = np.asarray(coef, dtype='float64').ravel()
+        self.intercept = float(np.asarray(intercept).ravel()[0])
+        # fold scaling into a single multiply and add
+        if min_ is None:
+            self.scale = np.ones(len(self.features))
+            self.shift = np.zeros(len(self.features))
+        else:
+            self.scale = 1 / np.asarray(range_, dtype='float64')
+            self.shift = -np.asarray(min_, dtype='float64') * self.scale
+        self.powers = None if powers is None else np.asarray(powers)
+
+    @classmethod
+    def from_record(cls, record):
+        '''
+
+        Takes registered ModelRecord of a linear model, a pipeline of
+        PolynomialFeatures into a linear model, or any model exposing
+        powers_, coef_ and intercept_, and returns its LinearPredictor
+
+        Scaling is matched to features by name, leaving features the
+        scaler does not cover unscaled. Raises ValueError if the scaler or
+        model features do not match the registered features, or if the
+        predictor does not reproduce the model's own predictions, e.g. for
+        a model with a non-identity link such as TweedieRegressor
+
+        '''
+
+        model = record.model
+        powers = None
+        # unpack polynomial pipeline into exponents and final model
+        if hasattr(model, 'steps'):
+            for _, step in model.steps[:-1]:
+                if hasattr(step, 'powers_'):
+                    powers = step.powers_
+            model = model.steps[-1][1]
+        elif hasattr(model, 'powers_'):
+            powers = model.powers_
+        features = list(record.features)
+        names = getattr(record.model, 'feature_names_in_', None)
+        if names is not None and list(names) != features:
+            raise ValueError(f'Model was fit to features {list(names)}, '
+                             f'registered with {features}')
+        # match scaling to features by name, unscaled features unchanged
+        min_ = np.zeros(len(features))
+        range_ = np.ones(len(features))
+        scaler = record.scaler
+        if scaler is not None:
+            if not all(hasattr(scaler, attr)
+                       for attr in ('features_', 'min_', 'range_')):
+                raise ValueError(f'Cannot serve scaler {scaler!r}, expected '
+                                 'a fitted MinMaxTransformer')
+            unknown = [col for col in scaler.features_
+                       if col not in features]
+            if len(unknown) > 0:
+                raise ValueError(f'Scaler features {unknown} are not '
+                                 f'registered features {features}')
+            for col, low, width in zip(scaler.features_, scaler.min_,
+                                       scaler.range_):
+                min_[features.index(col)] = low
+                range_[features.index(col)] = width
+        predictor = cls(features, model.coef_, model.intercept_,
+                        min_=min_, range_=range_, powers=powers)
+        # check array predictions against the model on probe rows
+        probe = min_ + range_ * np.random.RandomState(19).uniform(
+                                            0.1, 0.9, (8, len(features)))
+        expected = np.asarray(record.predict(
+                        pd.DataFrame(probe, columns=features)),
+                        dtype='float64').ravel()
+        if not np.allclose(predictor.predict(probe), expected, rtol=1e-6,
+                           atol=1e-6 * np.abs(expected).max()):
+            raise ValueError(f'Predictions of {model!r} are not linear in '
+                             'its coefficients, only linear models with an '
+                             'identity link can be served')
+
+        return predictor
+
+    def predict(self, rows):
+        '''
+
+        Takes 2D array-like of raw feature values, one row per property in
+        the order of features, and returns array of predictions
+
+        '''
+
+        # scale raw features
+        X = np.asarray(rows, dtype='float64') * self.scale + self.shift
+        # expand to polynomial terms
+        if self.powers is not None:
+            X = np.prod(X[:, None, :] ** self.powers[None, :, :], axis=2)
+
+        return X @ self.coef + self.intercept
+
+
+class LatencyStats:
+    '''
+
+    Thread safe counters of requests and rows served with a rolling window
+    of the latest window (default=10,000) request latencies, reporting
+    p50 and p99 latency and throughput since start
+
+    '''
+
+    def __init__(self, window=10_000):
+        self._lock = Lock()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.started = perf_counter()
+
+    def record(self, seconds, rows):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.rows += rows
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        '''
+
+        Returns dictionary of counters, latency percentiles in
+        milliseconds and throughput per second
+
+        '''
+
+        with self._lock:
+            latencies = np.array(self.latencies)
+            elapsed = perf_counter() - self.started
+            stats = {'requests': self.requests, 'rows': self.rows,
+                     'errors': self.errors,
+                     'requests_per_second': self.requests / elapsed,
+                     'rows_per_second': self.rows / elapsed}
+        if len(latencies) > 0:
+            p50, p99 = np.percentile(latencies * 1000, [50, 99])
+            stats.update({'p50_ms': p50, 'p99_ms': p99})
+
+        return stats
+
+
+#################### Serve Predictions ####################
+
+
+def parse_rows(body, features):
+    '''
+
+    Takes parsed JSON request body and list of features and returns 2D
+    float64 array of feature values with one row per property, raising
+    ValueError unless the body is an object holding a non-empty list of
+    rows, or a single row, of exactly the features as finite numbers
+
+    '''
+
+    if not isinstance(body, dict):
+        raise ValueError('Request body must be a JSON object')
+    # accept single object or list of rows
+    rows = body['rows'] if 'rows' in body else [body]
+    if not isinstance(rows, list) or len(rows) == 0:
+        raise ValueError('rows must be a non-empty list')
+    values = []
+    for row in rows:
+        if isinstance(row, dict):
+            if set(row) != set(features):
+                raise ValueError(f'Row must hold exactly features {features}')
+            row = [row[feature] for feature in features]
+        if not isinstance(row, list) or len(row) != len(features):
+            raise ValueError(f'Row must hold {len(features)} values in the '
+                             f'order {features}')
+        # reject nulls, booleans and strings before conversion
+        if not all(isinstance(value, (int, float))
+                   and not isinstance(value, bool) for value in row):
+            raise ValueError('Feature values must be numbers')
+        values.append(row)
+    values = np.array(values, dtype='float64')
+    if not np.isfinite(values).all():
+        raise ValueError('Feature values must be finite')
+
+    return values
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    '''
+
+    Handles prediction requests for the predictor and stats attached to
+    the server
+
+    POST /predict with JSON body of either {"rows": [[...], ...]} holding
+    feature values in order, {"rows": [{"feature": value}, ...]}, or a
+    single {"feature": value} object, returns {"predictions": [...]}, or
+    400 with an error for any other body (see parse_rows)
+
+    GET /stats returns request counters, latency and throughput
+
+    GET /health returns the features the model expects
+
+    '''
+
+    def _send(self, status, body):
+        payload = json.dumps(body, allow_nan=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.stats.snapshot())
+        elif self.path == '/health':
+            self._send(200, {'features': self.server.predictor.features})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'not found'})
+            return
+        start = perf_counter()
+        predictor = self.server.predictor
+        try:
+            body = json.loads(self.rfile.read(
+                                int(self.headers['Content-Length'])))
+            rows = parse_rows(body, predictor.features)
+            predictions = predictor.predict(rows)
+            if not np.isfinite(predictions).all():
+                raise ValueError('Predictions are not finite')
+            predictions = predictions.tolist()
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            self.server.stats.error()
+            self._send(400, {'error': repr(error)})
+            return
+        self._send(200, {'predictions': predictions})
+        self.server.stats.record(perf_counter() - start, len(rows))
+
+    def log_message(self, format, *args):
+        # keep request logging off the hot path
+        pass
+
+
+def make_server(model_name, host='127.0.0.1', port=8000, version=None):
+    '''
+
+    Takes name of a registered model and returns a threaded HTTP server
+    predicting with it at host and port, without starting it. The model
+    is loaded into a LinearPredictor once when the server is created
+
+    '''
+
+    # load model into plain arrays once
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.predictor = LinearPredictor.from_record(
+                                        load_model(model_name, version))
+    server.stats = LatencyStats()
+
+    return server
+
+
+def serve(model_name, host='127.0.0.1', port=8000, version=None):
+    '''
+
+    Takes name of a registered model and serves predictions from it at
+    host and port until interrupted
+
+    '''
+
+    server = make_server(model_name, host=host, port=port, version=version)
+    print(f'Serving {model_name} at http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve predictions from a '
+                                                 'registered model')
+    parser.add_argument('model_name')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--version', type=int, default=None)
+    args = parser.parse_args()
+    serve(args.model_name, host=args.host, port=args.port,
+          version=args.version)
@@ -0,0 +1,161 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+from scipy.spatial import cKDTree
+
+# import from created modules
+from stages import stage
+
+
+# zillow stores latitude and longitude as degrees times one million
+COORDINATE_SCALE = 1e6
+
+# mean earth radius and latitude the projection is centered on, near the
+# middle of the three counties
+EARTH_RADIUS_M = 6_371_008.8
+REFERENCE_LATITUDE = 34.0
+
+# number of properties queried at a time, bounding memory of queries
+BATCH_SIZE = 100_000
+
+
+#################### Project Locations ####################
+
+
+def project(latitude, longitude, scale=COORDINATE_SCALE):
+    '''
+
+    Takes latitude and longitude and returns array of (x, y) positions in
+    meters on an equirectangular projection centered on
+    REFERENCE_LATITUDE, so euclidean distances between nearby properties
+    are distances on the ground
+
+    scale=1e6 divides zillow coordinates back to degrees, default
+    behavior, while scale=1 takes coordinates in degrees
+
+    '''
+
+    lat = np.radians(np.asarray(latitude, dtype='float64') / scale)
+    lon = np.radians(np.asarray(longitude, dtype='float64') / scale)
+    x = EARTH_RADIUS_M * lon * np.cos(np.radians(REFERENCE_LATITUDE))
+    y = EARTH_RADIUS_M * lat
+
+    return np.column_stack((x, y))
+
+
+#################### Neighbor Features ####################
+
+
+class NeighborIndex:
+    '''
+
+    KD-tree over the projected locations of properties with known values,
+    answering k nearest neighbor queries for any number of properties in
+    batches of BATCH_SIZE in O(log n) each rather than comparing every
+    pair of properties
+
+    k: number of neighbors features are computed from
+
+    '''
+
+    def __init__(self, latitude, longitude, values, k=10):
+        self.k = k
+        self.values = np.asarray(values, dtype='float64').ravel()
+        self.tree = cKDTree(project(latitude, longitude))
+
+    def query(self, latitude, longitude, exclude_self=False):
+        '''
+
+        Takes latitude and longitude of properties and returns arrays of
+        the distances in meters to and positions of their k nearest
+        indexed neighbors, nearest first
+
+        exclude_self=True skips each property's own entry, for properties
+        in the same order as the index was built from, so a training
+        property's value is not used to describe itself
+
+        '''
+
+        points = project(latitude, longitude)
+        k = self.k + int(exclude_self)
+        distances = np.empty((len(points), self.k))
+        positions = np.empty((len(points), self.k), dtype='int64')
+        for start in range(0, len(points), BATCH_SIZE):
+            rows = slice(start, start + BATCH_SIZE)
+            distance, position = self.tree.query(points[rows], k=k,
+                                                 workers=-1)
+            distance = distance.reshape(len(distance), k)
+            position = position.reshape(len(position), k)
+            if exclude_self == True:
+                # drop own entry, or the farthest if tied points hid it
+                keep = position != np.arange(start, start + len(position)
+                                             )[:, None]
+                keep[keep.all(axis=1), -1] = False
+                distance = distance[keep].reshape(len(distance), self.k)
+                position = position[keep].reshape(len(position), self.k)
+            distances[rows], positions[rows] = distance, position
+
+        return distances, positions
+
+    def features(self, latitude, longitude, exclude_self=False):
+        '''
+
+        Takes latitude and longitude of properties and returns DataFrame
+        of neighborhood features of each: the median value of its k
+        nearest neighbors, the mean distance to them and distance to the
+        farthest of them in meters, and the local density of properties
+        per square kilometer within that distance
+
+        '''
+
+        distances, positions = self.query(latitude, longitude,
+                                          exclude_self=exclude_self)
+        # radius holding k neighbors, at least a meter for tied points
+        radius = np.maximum(distances[:, -1], 1)
+        df = pd.DataFrame({
+            'knn_median_value': np.median(self.values[positions], axis=1),
+            'knn_mean_distance_m': distances.mean(axis=1),
+            'knn_max_distance_m': distances[:, -1],
+            'knn_density_km2': self.k / (np.pi * (radius / 1000) ** 2),
+            }, index=getattr(latitude, 'index', None))
+
+        return df
+
+
+@stage('neighbor_index', persist=True)
+def build_neighbor_index(latitude, longitude, values, k=10):
+    '''
+
+    Takes latitude, longitude and values of properties and returns their
+    NeighborIndex, persisted to the stage cache so the tree is only built
+    again when the properties change
+
+    '''
+
+    return NeighborIndex(latitude, longitude, values, k=k)
+
+
+def add_neighbor_features(X_train, y_train, *others, k=10,
+                          latitude='latitude', longitude='longitude'):
+    '''
+
+    Takes X and y for train and any number of other X, e.g. validate and
+    test, builds a NeighborIndex of the train properties and returns each
+    X with neighbor features of its properties added. Train properties
+    exclude themselves from their neighbors and other splits only use
+    train properties, so no split sees values it should not
+
+    '''
+
+    index = build_neighbor_index(X_train[latitude], X_train[longitude],
+                                 y_train, k=k)
+    frames = [X_train.join(index.features(X_train[latitude],
+                                          X_train[longitude],
+                                          exclude_self=True))]
+    for X in others:
+        frames.append(X.join(index.features(X[latitude], X[longitude])))
+
+    return frames
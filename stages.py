@@ -0,0 +1,173 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+import pickle
+from collections import OrderedDict
+from functools import wraps
+from hashlib import sha1
+from os import makedirs, replace
+from os.path import isfile, join
+from threading import Lock
+
+
+# number of stage outputs kept in memory before least recently used are
+# evicted
+MAX_STAGES = 16
+
+# set True to also persist stage outputs to STAGE_DIR between sessions
+PERSIST = False
+STAGE_DIR = join('cache', 'stages')
+
+# in-memory stage outputs by key, ordered from least to most recently used
+_memo = OrderedDict()
+_memo_lock = Lock()
+
+
+#################### Fingerprint Data ####################
+
+
+def fingerprint(obj):
+    '''
+
+    Takes any object and returns a hex digest identifying its content.
+    DataFrames and Series are hashed by their values, index, column names
+    and dtypes, arrays by their bytes, containers by their items and any
+    other object by its repr
+
+    '''
+
+    digest = sha1()
+    _update(digest, obj)
+
+    return digest.hexdigest()
+
+
+def _update(digest, obj):
+    '''
+
+    Feeds the content of obj into digest, recursing into containers
+
+    '''
+
+    # hash pandas objects by row hashes plus their labels and dtypes
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        digest.update(type(obj).__name__.encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True)
+                      .to_numpy().tobytes())
+        if isinstance(obj, pd.DataFrame):
+            digest.update(repr(list(obj.columns)).encode())
+            digest.update(repr(list(obj.dtypes.astype(str))).encode())
+        else:
+            digest.update(repr((obj.name, str(obj.dtype))).encode())
+    elif isinstance(obj, np.ndarray):
+        digest.update(repr((obj.shape, str(obj.dtype))).encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        digest.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            _update(digest, item)
+    elif isinstance(obj, dict):
+        digest.update(f'dict{len(obj)}'.encode())
+        for key in sorted(obj, key=repr):
+            _update(digest, key)
+            _update(digest, obj[key])
+    else:
+        digest.update(repr(obj).encode())
+
+
+#################### Memoize Stages ####################
+
+
+def _copy(result):
+    '''
+
+    Returns a copy of a stage output so callers can modify it without
+    changing the memoized output
+
+    '''
+
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy()
+    if isinstance(result, tuple):
+        return tuple(_copy(item) for item in result)
+    if isinstance(result, list):
+        return [_copy(item) for item in result]
+
+    return result
+
+
+def _remember(key, result):
+    '''
+
+    Stores stage output in memory, evicting the least recently used
+    outputs beyond MAX_STAGES
+
+    '''
+
+    with _memo_lock:
+        _memo[key] = result
+        _memo.move_to_end(key)
+        while len(_memo) > MAX_STAGES:
+            _memo.popitem(last=False)
+
+
+def stage(name, persist=None):
+    '''
+
+    Decorator memoizing a pipeline stage by a fingerprint of its name and
+    the content of every argument it is called with, so a stage only runs
+    again when its inputs or parameters change. Outputs are kept in
+    memory with least recently used eviction and returned as copies
+
+    persist=None follows the module PERSIST setting, default behavior
+
+    persist=True or False overrides PERSIST for this stage, storing
+    outputs as pickles in STAGE_DIR to be reused by later sessions
+
+    '''
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # key output by stage name and content of arguments
+            key = f'{name}_{fingerprint((args, kwargs))}'
+            save = PERSIST if persist == None else persist
+            path = join(STAGE_DIR, f'{key}.pkl')
+            # check memory, then disk, before running stage
+            with _memo_lock:
+                if key in _memo:
+                    _memo.move_to_end(key)
+                    return _copy(_memo[key])
+            if save == True and isfile(path):
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+            else:
+                result = func(*args, **kwargs)
+                if save == True:
+                    # write to temporary file then swap into place
+                    makedirs(STAGE_DIR, exist_ok=True)
+                    with open(f'{path}.tmp', 'wb') as f:
+                        pickle.dump(result, f)
+                    replace(f'{path}.tmp', path)
+            _remember(key, result)
+
+            return _copy(result)
+
+        return wrapper
+
+    return decorator
+
+
+def clear_stages():
+    '''
+
+    Forgets all stage outputs held in memory, leaving any persisted to
+    STAGE_DIR in place
+
+    '''
+
+    with _memo_lock:
+        _memo.clear()
@@ -0,0 +1,111 @@
+#Z0096
+
+
+# import from python libraries and modules
+import numpy as np
+
+
+#################### Merge Moments ####################
+
+
+def merge_moments(n, mean, m2, chunk_n, chunk_mean, chunk_m2):
+    '''
+
+    Takes count, mean and sum of squared deviations of the rows seen so
+    far and of a new chunk of rows, and returns the count, mean and sum of
+    squared deviations of all of them (Chan et al.), without revisiting
+    the rows seen so far
+
+    Counts broadcast against the means, so per group counts are passed
+    with a trailing axis, e.g. n[:, None], to merge moments of many
+    models or columns per group at once. Counts of the rows seen so far
+    may be 0, but not every combined count
+
+    '''
+
+    total = n + chunk_n
+    delta = chunk_mean - mean
+    mean = mean + delta * chunk_n / total
+    m2 = m2 + chunk_m2 + delta ** 2 * n * chunk_n / total
+
+    return total, mean, m2
+
+
+#################### Grow Group State ####################
+
+
+def grow_groups(state, names, positions, groups, labels, fill=None):
+    '''
+
+    Takes dictionary state holding arrays of names with one row per group,
+    dictionary of the position of each group label seen, list of those
+    labels in order, and the group labels of a chunk, appends empty rows
+    to every named array for labels not seen before and returns the
+    position of each label in the arrays
+
+    fill=None starts new rows at 0, default behavior, while
+    fill={name: value} starts rows of the named arrays at value instead,
+    e.g. inf for running minimums
+
+    '''
+
+    new = [label for label in labels if label not in positions]
+    for label in new:
+        positions[label] = len(groups)
+        groups.append(label)
+    # extend every state array with empty groups
+    if len(new) > 0:
+        fill = fill or {}
+        for name in names:
+            values = state[name]
+            pad = np.full((len(new),) + values.shape[1:], fill.get(name, 0),
+                          dtype=values.dtype)
+            state[name] = np.concatenate((values, pad))
+
+    return np.array([positions[label] for label in labels], dtype='int64')
+
+
+#################### Histogram Quantiles ####################
+
+
+def bin_positions(values, bins):
+    '''
+
+    Takes array of values and bin edges and returns the histogram position
+    of each value, with position 0 below the first edge and the final
+    position, len(bins), above the last edge. The last edge itself is
+    counted in the last bin as np.histogram does
+
+    '''
+
+    positions = np.searchsorted(bins, values, side='right')
+    positions[values == bins[-1]] = len(bins) - 1
+
+    return positions
+
+
+def histogram_quantiles(counts, bins, quantiles):
+    '''
+
+    Takes array of counts with its last axis holding the count below the
+    first edge of bins, in each bin and above the last edge, as counted
+    from bin_positions, and returns quantiles interpolated within their
+    bin, or NaN where a quantile falls outside the binned range
+
+    '''
+
+    cumulative = np.cumsum(counts, axis=-1)
+    values = np.full(counts.shape[:-1] + (len(quantiles),), np.nan)
+    for index in np.ndindex(counts.shape[:-1]):
+        for i, q in enumerate(quantiles):
+            target = cumulative[index][-1] * q
+            position = np.searchsorted(cumulative[index], target)
+            if position == 0 or position == counts.shape[-1] - 1:
+                continue
+            before = cumulative[index][position - 1]
+            left = bins[position - 1]
+            width = bins[position] - left
+            values[index + (i,)] = (left + width * (target - before) /
+                                    counts[index + (position,)])
+
+    return values
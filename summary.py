@@ -0,0 +1,225 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+
+# import from created modules
+from stages import stage
+
+
+#################### Summarize Data ####################
+
+
+def pairwise_moments(values):
+    '''
+
+    Takes float array with one column per variable and NaN where a value
+    is missing, and returns square arrays over the rows complete in each
+    pair of columns (i, j): the row count, the mean of column i, the
+    centered sum of cross products of columns i and j, and the centered
+    sum of squares of column i
+
+    '''
+
+    present = ~np.isnan(values)
+    weights = present.astype('float64')
+    # center on column means first for precision, which leaves centered
+    # sums unchanged
+    shift = np.zeros(values.shape[1])
+    counts = present.sum(axis=0)
+    shift[counts > 0] = np.nanmean(values[:, counts > 0], axis=0)
+    centered = np.where(present, values - shift, 0)
+    # sums over rows where both columns of each pair are present
+    n = weights.T @ weights
+    sums = centered.T @ weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / n
+        cross = centered.T @ centered - sums * sums.T / n
+        squares = (centered ** 2).T @ weights - sums ** 2 / n
+
+    return n, means + shift[:, None], cross, squares
+
+
+class Summary:
+    '''
+
+    Holds summary statistics of every numeric column of a DataFrame,
+    computed once so that plots can be drawn from them without passing
+    over the raw data again
+
+    stats: DataFrame of count, mean, std, min, median and max per column
+
+    quantiles: DataFrame of the letter value quantiles per column, i.e.
+    the 1/2, 1/4, 1/8, ... tails down to the depth boxen plots use
+
+    histograms: dictionary of column to (counts, bin edges) using bins
+    (default=50) equal width bins from minimum to maximum
+
+    Correlation sufficient statistics (row count, means, centered cross
+    products and sums of squares over the rows complete in each pair of
+    columns) are kept to obtain any pearson r or least squares line
+    without the data, each from every row where both of its columns
+    have values
+
+    '''
+
+    def __init__(self, df, bins=50):
+        # use only numeric columns as float64 array
+        numeric = df.select_dtypes('number')
+        values = numeric.to_numpy(dtype='float64')
+        self.columns = list(numeric)
+        self.n_rows = len(values)
+        # per column statistics ignoring nulls
+        self.stats = pd.DataFrame({
+            'count': (~np.isnan(values)).sum(axis=0),
+            'mean': np.nanmean(values, axis=0),
+            'std': np.nanstd(values, axis=0, ddof=1),
+            'min': np.nanmin(values, axis=0),
+            'median': np.nanmedian(values, axis=0),
+            'max': np.nanmax(values, axis=0),
+            }, index=self.columns)
+        # letter value quantiles to the tukey depth used by boxen plots
+        depth = max(int(np.log2(max(self.n_rows, 1))) - 3, 1)
+        tails = 0.5 ** np.arange(1, depth + 1)
+        probabilities = np.unique(np.concatenate((tails, 1 - tails)))
+        self.quantiles = pd.DataFrame(
+                            np.nanquantile(values, probabilities, axis=0),
+                            index=probabilities, columns=self.columns)
+        # equal width histogram counts per column
+        self.histograms = {}
+        for i, col in enumerate(self.columns):
+            column = values[:, i]
+            self.histograms[col] = np.histogram(column[~np.isnan(column)],
+                                                bins=bins)
+        # centered cross products over rows complete in each pair
+        (self.n_pairs, self.pair_means, self.cross,
+         self.squares) = pairwise_moments(values)
+
+    def _position(self, col):
+        return self.columns.index(col)
+
+    def corr(self, x, y):
+        '''
+
+        Returns pearson r between columns x and y
+
+        '''
+
+        i, j = self._position(x), self._position(y)
+
+        return self.cross[i, j] / np.sqrt(self.squares[i, j] *
+                                          self.squares[j, i])
+
+    def corr_matrix(self):
+        '''
+
+        Returns DataFrame of pearson r between every pair of columns
+
+        '''
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = self.cross / np.sqrt(self.squares * self.squares.T)
+
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def line(self, x, y):
+        '''
+
+        Returns slope and intercept of the least squares line of y on x
+        over the rows where both have values
+
+        '''
+
+        i, j = self._position(x), self._position(y)
+        slope = self.cross[i, j] / self.squares[i, j]
+        intercept = self.pair_means[j, i] - slope * self.pair_means[i, j]
+
+        return slope, intercept
+
+    def letter_values(self, col):
+        '''
+
+        Returns list of (lower, upper) letter value pairs of column from
+        the widest box, the quartiles, to the narrowest
+
+        '''
+
+        quantiles = self.quantiles[col]
+        tails = [p for p in quantiles.index if p < 0.5][::-1]
+
+        return [(quantiles[p], quantiles[1 - p]) for p in tails]
+
+    def kde(self, col, points=200):
+        '''
+
+        Returns grid and density of a gaussian kernel density estimate of
+        column, computed from its binned counts using scott's bandwidth
+
+        '''
+
+        counts, edges = self.histograms[col]
+        centers = (edges[:-1] + edges[1:]) / 2
+        n = counts.sum()
+        bandwidth = self.stats.loc[col, 'std'] * n ** (-1 / 5)
+        grid = np.linspace(edges[0], edges[-1], points)
+        if n == 0 or not bandwidth > 0:
+            return grid, np.zeros(points)
+        # sum of kernels at bin centers weighted by bin counts
+        z = (grid[:, None] - centers[None, :]) / bandwidth
+        density = (np.exp(-z ** 2 / 2) @ counts) / (n * bandwidth *
+                                                     np.sqrt(2 * np.pi))
+
+        return grid, density
+
+
+@stage('summarize')
+def summarize(df, bins=50):
+    '''
+
+    Takes DataFrame and returns its Summary, memoized by the content of
+    the data so every plot of the same dataset version reuses the same
+    precomputed statistics
+
+    '''
+
+    return Summary(df, bins=bins)
+
+
+#################### Sample Data ####################
+
+
+def decimate(df, max_points=10_000, by=None, strata=10, random_state=19):
+    '''
+
+    Takes DataFrame and returns at most max_points of its rows for
+    plotting, or the DataFrame itself if it already fits
+
+    by=None samples rows uniformly at random, default behavior
+
+    by='column' keeps up to an equal share of rows from each of strata
+    equal width bins of that column, so sparse tails stay visible after
+    sampling
+
+    '''
+
+    # check if sampling is needed
+    if max_points == None or len(df) <= max_points:
+        return df
+    if by == None:
+        return df.sample(n=max_points, random_state=random_state)
+    # assign every row to an equal width bin of by
+    codes = pd.cut(df[by], strata, labels=False).to_numpy()
+    share = max_points // strata
+    rng = np.random.RandomState(random_state)
+    positions = []
+    for code in range(strata):
+        # sample up to share rows from each bin
+        members = np.flatnonzero(codes == code)
+        if len(members) > share:
+            members = rng.choice(members, size=share, replace=False)
+        positions.append(members)
+    positions = np.sort(np.concatenate(positions))
+
+    return df.iloc[positions]
@@ -0,0 +1,227 @@
+#Z0096
+
+
+# import from python libraries and modules
+import pandas as pd
+import numpy as np
+
+# import visual tools
+import matplotlib.pyplot as plt
+
+# import from created modules
+from acquire import iter_source, iter_sql_cached, tax_query
+from prepare import map_fips
+from streaming import (bin_positions, grow_groups, histogram_quantiles,
+                       merge_moments)
+
+
+# bin edges of tax rate distributions, matching get_tax_rates
+TAX_RATE_BINS = np.linspace(0, 0.1, 50)
+
+# attributes of TaxRateStats holding one row per group
+STATE_ARRAYS = ('n_', 'tax_amount_', 'tax_value_', 'mean_', 'm2_', 'min_',
+                'max_', 'counts_')
+
+
+#################### Stream Tax Rates ####################
+
+
+class TaxRateStats:
+    '''
+
+    Maintains running tax rate statistics and fixed-bin histograms for
+    each group of properties, updated one chunk at a time so that tax
+    rates over any number of properties are computed with memory
+    proportional to the number of groups and bins only
+
+    For each group keeps the count of properties, sums of tax amount and
+    tax value, running mean and sum of squared deviations of the tax rate
+    (merged per chunk, Chan et al.), minimum and maximum tax rate, and
+    counts of tax rates falling in each bin of bins (default
+    TAX_RATE_BINS), below the first edge, and above the last edge
+
+    '''
+
+    def __init__(self, bins=TAX_RATE_BINS):
+        self.bins = np.asarray(bins)
+        self.by_ = None
+        self.groups_ = []
+        self._positions = {}
+        n_bins = len(self.bins) - 1
+        self.n_ = np.zeros(0, dtype='int64')
+        self.tax_amount_ = np.zeros(0)
+        self.tax_value_ = np.zeros(0)
+        self.mean_ = np.zeros(0)
+        self.m2_ = np.zeros(0)
+        self.min_ = np.zeros(0)
+        self.max_ = np.zeros(0)
+        self.counts_ = np.zeros((0, n_bins + 2), dtype='int64')
+
+    def update(self, df, by='county', tax_amount='tax_amount_usd',
+               tax_value='tax_value_usd'):
+        '''
+
+        Takes DataFrame chunk of properties and merges the tax rates of
+        its rows into the running statistics of their group. Rows with a
+        missing group, a missing tax amount or a missing or non-positive
+        tax value are skipped
+
+        '''
+
+        # compute tax rate of every valid row with a group
+        amount = df[tax_amount].to_numpy(dtype='float64')
+        value = df[tax_value].to_numpy(dtype='float64')
+        valid = ~np.isnan(amount) & (value > 0) & df[by].notna().to_numpy()
+        amount, value = amount[valid], value[valid]
+        rate = amount / value
+        if len(rate) == 0:
+            return self
+        # assign each row the position of its group
+        self.by_ = by
+        codes, labels = pd.factorize(df[by].to_numpy()[valid])
+        # state arrays are attributes, so grow them in the instance dict
+        groups = grow_groups(vars(self), STATE_ARRAYS, self._positions,
+                             self.groups_, list(labels),
+                             fill={'min_': np.inf, 'max_': -np.inf})
+        n_groups = len(labels)
+        # per group sums of chunk in a single bincount each
+        n = np.bincount(codes, minlength=n_groups)
+        mean = np.bincount(codes, weights=rate, minlength=n_groups) / n
+        m2 = np.bincount(codes, weights=(rate - mean[codes]) ** 2,
+                         minlength=n_groups)
+        # merge chunk mean and squared deviations into running values
+        (self.n_[groups], self.mean_[groups],
+         self.m2_[groups]) = merge_moments(self.n_[groups], self.mean_[groups],
+                                           self.m2_[groups], n, mean, m2)
+        self.tax_amount_[groups] += np.bincount(codes, weights=amount,
+                                                minlength=n_groups)
+        self.tax_value_[groups] += np.bincount(codes, weights=value,
+                                               minlength=n_groups)
+        # per group extremes
+        np.minimum.at(self.min_, groups[codes], rate)
+        np.maximum.at(self.max_, groups[codes], rate)
+        bin_ = bin_positions(rate, self.bins)
+        width = self.counts_.shape[1]
+        counts = np.bincount(codes * width + bin_, minlength=n_groups * width)
+        self.counts_[groups] += counts.reshape(n_groups, width)
+
+        return self
+
+    def histograms(self):
+        '''
+
+        Returns DataFrame of the count of tax rates in each bin for each
+        group, indexed by the left edge of the bin
+
+        '''
+
+        # drop below and above range positions
+        df = pd.DataFrame(self.counts_[:, 1:-1].T, columns=self.groups_,
+                          index=pd.Index(self.bins[:-1], name='tax_rate'))
+
+        return df[sorted(self.groups_)]
+
+    def summary(self):
+        '''
+
+        Returns DataFrame of tax rate statistics for each group, with the
+        median tax rate approximated from the histogram bins
+
+        '''
+
+        # interpolate median within the bin holding the middle rate
+        medians = histogram_quantiles(self.counts_, self.bins, [0.5])[:, 0]
+        df = pd.DataFrame({
+            'avg_tax_amount_usd': self.tax_amount_ / self.n_,
+            'avg_tax_value_usd': self.tax_value_ / self.n_,
+            'tax_rate': self.mean_,
+            'approx_median_tax_rate': medians,
+            'properties': self.n_,
+            'weighted_tax_rate': self.tax_amount_ / self.tax_value_,
+            'std_tax_rate': np.sqrt(self.m2_ / self.n_),
+            'min_tax_rate': self.min_,
+            'max_tax_rate': self.max_,
+            }, index=pd.Index(self.groups_, name=self.by_))
+
+        return df.sort_index()
+
+
+def iter_tax_chunks(source=None, chunksize=100_000, use_csv=True):
+    '''
+
+    Yields DataFrame chunks of property tax rows from source, adding a
+    county column from fips when the rows have no county
+
+    source=None streams every property from the tax_query cache,
+    acquiring it in chunks first if it does not exist, default behavior
+
+    source='path.csv' or 'path.parquet' streams rows from that file, e.g.
+    the published tax_rates.csv
+
+    source='directory' streams rows from the parts of a query cache
+
+    source=iterable of DataFrames streams those chunks as passed
+
+    '''
+
+    # choose reader for source
+    if source is None:
+        chunks = iter_sql_cached(tax_query, 'zillow', use_csv=use_csv,
+                                 chunksize=chunksize)
+    elif isinstance(source, str):
+        chunks = iter_source(source, chunksize=chunksize)
+    else:
+        chunks = source
+    for chunk in chunks:
+        # add county names if only fips codes are present
+        if 'county' not in chunk and 'fips' in chunk:
+            chunk = chunk.assign(county=map_fips(chunk.fips))
+        yield chunk
+
+
+def stream_tax_rates(source=None, by='county', chunksize=100_000,
+                     bins=TAX_RATE_BINS, use_csv=True):
+    '''
+
+    Streams property tax rows from source (see iter_tax_chunks) chunk by
+    chunk and returns TaxRateStats holding tax rate statistics and
+    histograms for each group of by (default='county'), using constant
+    memory however many rows the source holds
+
+    '''
+
+    # merge every chunk into running statistics
+    stats = TaxRateStats(bins=bins)
+    for chunk in iter_tax_chunks(source, chunksize=chunksize,
+                                 use_csv=use_csv):
+        stats.update(chunk, by=by)
+
+    return stats
+
+
+#################### Visualize Tax Rates ####################
+
+
+def plot_tax_rates(stats, colors=('red', 'green', 'blue')):
+    '''
+
+    Takes TaxRateStats and plots the tax rate distribution of each group
+    from its precomputed histogram, matching the get_tax_rates plot
+
+    '''
+
+    # obtain binned counts for each group
+    df = stats.histograms()
+    # set figure dimensions for plot
+    plt.figure(figsize=(30,15))
+    # start plot, weighting each bin by its count
+    for i, group in enumerate(df):
+        plt.hist(stats.bins[:-1], bins=stats.bins, weights=df[group],
+                 color=colors[i % len(colors)], alpha=0.25, log=True,
+                 label=group)
+    plt.rcParams['legend.title_fontsize'] = 20
+    plt.xlim(stats.bins[0], stats.bins[-1])
+    plt.xlabel('Tax Rate')
+    plt.title('Distributions of Tax Rates for Each County')
+    plt.legend(title='County')
+    plt.show()